@@ -0,0 +1,200 @@
+""" mergeable per-cell aggregates of consumption.
+
+a cell is one hour of the week (weekday*24 + hour), optionally with another
+grouping dimension in front (segment*168 + cell). for every cell and meter
+CellAggregate keeps the number of rows, the number of known values, their
+mean, sum of squared deviations (M2), minimum and maximum. aggregates of
+different blocks of rows are merged with Chan's parallel formulas, and every
+feature that is a statistic of consumption over a set of cells (c_ht,
+s_var_wd, we_min, ...) or a combination of such features (r_nt_ht, ...) is
+computed from the table without touching the readings again.
+"""
+import functools
+
+import numpy as np
+
+from featureExtractor import Extractor
+from fleetExtractor import (MEANS, VARIANCES, MINIMA, MAXIMA, RATIOS, NO_MIN,
+                            RATIOS_NO_MIN)
+
+CELLS = 7*24
+
+PERIODS = ['morning', 'noon', 'afternoon', 'evening', 'night', 'ht', 'nt']
+
+
+def calendar_codes(index):
+    """ cell (weekday*24 + hour) of every timestamp. """
+    return index.weekday.values.astype(np.intp)*24 + index.hour.values
+
+
+class CellAggregate:
+    """ rows, n, mean, m2, min, max of consumption, arrays of shape (cells, meters). """
+
+    def __init__(self, rows, n, mean, m2, min, max):
+        self.rows = rows
+        self.n = n
+        self.mean = mean
+        self.m2 = m2
+        self.min = min
+        self.max = max
+
+    @classmethod
+    def empty(cls, cells, meters):
+        zeros = np.zeros((cells, meters))
+        return cls(zeros.copy(), zeros.copy(), zeros.copy(), zeros.copy(),
+                   np.full((cells, meters), np.nan), np.full((cells, meters), np.nan))
+
+    @classmethod
+    def from_values(cls, values, codes, cells=CELLS):
+        """ aggregate values (time, meters) by codes (time,) in [0, cells). """
+        values = np.asarray(values, dtype=np.float64).reshape(len(codes), -1)
+        aggregate = cls.empty(cells, values.shape[1])
+        if len(codes) == 0:
+            return aggregate
+        order = np.argsort(codes, kind='stable')
+        v = values[order]
+        present, starts, rows = np.unique(
+            codes[order], return_index=True, return_counts=True)
+        valid = ~np.isnan(v)
+        n = np.add.reduceat(valid, starts, axis=0).astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.add.reduceat(np.where(valid, v, 0), starts, axis=0)/n
+        mean = np.where(n > 0, mean, 0)
+        deviation = np.where(valid, v - np.repeat(mean, rows, axis=0), 0)
+        aggregate.rows[present] = rows[:, None]
+        aggregate.n[present] = n
+        aggregate.mean[present] = mean
+        aggregate.m2[present] = np.add.reduceat(deviation*deviation, starts, axis=0)
+        aggregate.min[present] = np.fmin.reduceat(v, starts, axis=0)
+        aggregate.max[present] = np.fmax.reduceat(v, starts, axis=0)
+        return aggregate
+
+    def merge(self, other):
+        """ aggregate of both blocks of rows. """
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(n > 0, other.n/n, 0)
+        return CellAggregate(self.rows + other.rows, n,
+                             self.mean + delta*weight,
+                             self.m2 + other.m2 + delta*delta*self.n*weight,
+                             np.fmin(self.min, other.min), np.fmax(self.max, other.max))
+
+    def remove(self, other):
+        """ aggregate without the rows of other (which must be contained in self).
+        min and max can not be removed and are left as they are. """
+        n = self.n - other.n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(n > 0, (self.n*self.mean - other.n*other.mean)/n, 0)
+        delta = other.mean - mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(n > 0, other.n/self.n, 0)
+        m2 = np.maximum(self.m2 - other.m2 - delta*delta*n*weight, 0)
+        return CellAggregate(self.rows - other.rows, n, mean,
+                             np.where(n > 0, m2, 0), self.min, self.max)
+
+    def combine(self, cells):
+        """ (rows, n, mean, m2, min, max) over a bool mask of cells, each (meters,). """
+        n = self.n[cells].sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = (self.n[cells]*self.mean[cells]).sum(axis=0)/n
+        delta = self.mean[cells] - mean
+        m2 = self.m2[cells].sum(axis=0) + (self.n[cells]*delta*delta).sum(axis=0)
+        minimum = np.fmin.reduce(self.min[cells], axis=0, initial=np.nan)
+        maximum = np.fmax.reduce(self.max[cells], axis=0, initial=np.nan)
+        return self.rows[cells].sum(axis=0), n, mean, m2, minimum, maximum
+
+    def segments(self, count):
+        """ split a (count*CELLS, meters) aggregate into one aggregate per segment. """
+        def part(a, s):
+            return a.reshape(count, CELLS, -1)[s]
+        return [CellAggregate(*(part(a, s) for a in (self.rows, self.n, self.mean,
+                                                      self.m2, self.min, self.max)))
+                for s in range(count)]
+
+
+def cell_masks(periods):
+    """ {data name: bool (CELLS,)} for weekdays, weekends and the periods of the day
+    in the period config ('mornings', ..., 'hts', 'nts'). """
+    hours = np.arange(CELLS) % 24
+    days = np.arange(CELLS) // 24
+    masks = {'weekdays': days < 5, 'weekends': days >= 5}
+    for p in PERIODS:
+        if f'{p}_start' in periods and f'{p}_end' in periods:
+            masks[f'{p}s'] = ((hours >= periods[f'{p}_start'])
+                              & (hours < periods[f'{p}_end']))
+    return masks
+
+
+def _statistic(aggregate, cells, statistic):
+    rows, n, mean, m2, minimum, maximum = aggregate.combine(cells)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if statistic == 'mean':
+            return np.where(n > 0, mean, np.nan)
+        if statistic == 'var':
+            return np.where(n > 1, m2/(n - 1), np.nan)
+    return minimum if statistic == 'min' else maximum
+
+
+def cell_features(aggregate, periods, granularity, extra={}):
+    """ features computable from a cell aggregate, {feature: (meters,) array}.
+    extra are features computed elsewhere (e.g. c_week) used by the ratios. """
+    masks = cell_masks(periods)
+    everything = np.ones(len(aggregate.n), dtype=bool)
+    features = {}
+    for table, statistic in ((MEANS, 'mean'), (VARIANCES, 'var'),
+                             (MINIMA, 'min'), (MAXIMA, 'max')):
+        for name, needs in table.items():
+            if Extractor.features_min_granularity.get(name, np.inf) < granularity:
+                continue
+            if not all(m in masks for m in needs):
+                continue
+            cells = functools.reduce(np.logical_and, [masks[m] for m in needs], everything)
+            features[name] = _statistic(aggregate, cells, statistic)
+
+    if 'hts' in masks and granularity <= 60:
+        rows, n, mean, m2, _, _ = aggregate.combine(masks['hts'])
+        # c_ht_var divides by all ht rows, known or not
+        with np.errstate(invalid='ignore', divide='ignore'):
+            features['c_ht_var'] = m2/rows
+
+    available = dict(extra, **features)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for name, (a, b) in RATIOS.items():
+            if a in available and b in available:
+                features[name] = available[a]/available[b]
+        for name, (a, c_min) in NO_MIN.items():
+            if a in available and c_min in available:
+                features[name] = available[a] - available[c_min]
+        for name, (a, b, c_min) in RATIOS_NO_MIN.items():
+            if all(f in available for f in (a, b, c_min)):
+                features[name] = ((available[a] - available[c_min])
+                                  / (available[b] - available[c_min]))
+        if 'wd_min' in features and 'we_min' in features:
+            we_min = features['we_min']
+            features['r_min_wd_we'] = np.where(
+                we_min == 0, np.nan, features['wd_min']/we_min)
+    return features
+
+
+def _sliding(accumulate, x, window):
+    """ van Herk / Gil-Werman sliding reduction along axis 0: result[i] reduces
+    x[i:i + window]. O(len(x)) for any window, nan values are ignored. """
+    n = len(x)
+    blocks = -(-n // window)
+    padded = np.full((blocks*window,) + x.shape[1:], np.nan)
+    padded[:n] = x
+    padded = padded.reshape((blocks, window) + x.shape[1:])
+    prefix = accumulate(padded, axis=1).reshape((-1,) + x.shape[1:])
+    suffix = accumulate(padded[:, ::-1], axis=1)[:, ::-1].reshape((-1,) + x.shape[1:])
+    return accumulate.__self__(suffix[:n - window + 1], prefix[window - 1:n])
+
+
+def sliding_min(x, window):
+    """ minimum of every window of `window` consecutive rows of x, (len(x) - window + 1, ...). """
+    return _sliding(np.fmin.accumulate, x, window)
+
+
+def sliding_max(x, window):
+    """ maximum of every window of `window` consecutive rows of x, (len(x) - window + 1, ...). """
+    return _sliding(np.fmax.accumulate, x, window)
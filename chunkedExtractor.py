@@ -0,0 +1,259 @@
+""" chunked extraction for fleets whose (time x meters) matrix does not fit in memory.
+
+the matrix is split into blocks of `meters_per_block` meters and
+`rows_per_block` rows. a process pool computes a mergeable partial aggregate
+of every block and spills it to disk:
+
+- per cell (weekday, hour) count, mean, M2, min and max (aggregates.CellAggregate),
+- daily sums, minima and maxima and weekly sums,
+- average-week slot sums over the complete weeks,
+- number of zeros, sum of absolute differences and the first and last row.
+
+the partials of a meter group are then merged in time order, one at a time,
+and the features are computed from the merged aggregate. only features that
+can be computed exactly from these aggregates are supported (CHUNKED_FEATURES),
+all others are reported as not implemented. at most `workers` blocks are
+held in memory at once.
+
+    source = CsvSource(glob.glob('meters/*.csv'))
+    chunked = ChunkedExtractor(source, periods, workers=8)
+    chunked._extract(['c_ht', 'r_nt_ht', 's_wd_max'])
+    chunked.extracted  # DataFrame, meters x features
+"""
+import os
+import pickle
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from aggregates import CellAggregate, calendar_codes, cell_features
+from featureExtractor import Extractor, Reason
+from fleetExtractor import (MEANS, VARIANCES, MINIMA, MAXIMA, RATIOS, NO_MIN,
+                            RATIOS_NO_MIN)
+
+
+class FrameSource:
+    """ blocks of an in-memory DataFrame (time x meters). """
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.meters = list(frame.columns)
+        self.length = len(frame)
+
+    def read(self, meters, start, stop):
+        return self.frame[meters].iloc[start:stop]
+
+
+class CsvSource:
+    """ one csv per meter with the layout of data/consumption.csv, all on the same
+    time grid. the meter id is the file name without extension. the byte offset
+    of every `checkpoint`-th row is indexed once per file, a block seeks to the
+    checkpoint before it and parses at most checkpoint - 1 rows it does not need. """
+
+    def __init__(self, paths, checkpoint=4096):
+        self.paths = {os.path.splitext(os.path.basename(p))[0]: p for p in sorted(paths)}
+        self.meters = list(self.paths)
+        self.checkpoint = checkpoint
+        self.offsets = {}
+        self.lengths = {}
+        for m, path in self.paths.items():
+            self.offsets[m], self.lengths[m] = self._index(path)
+        self.length = self.lengths[self.meters[0]]
+
+    def _index(self, path):
+        """ (offsets of rows 0, checkpoint, 2*checkpoint, ..., number of rows). """
+        with open(path, 'rb') as f:
+            content = f.read()
+        # rows start after every newline, the first one ends the header
+        starts = np.flatnonzero(np.frombuffer(content, dtype=np.uint8) == ord('\n')) + 1
+        starts = starts[starts < len(content)]
+        return starts[::self.checkpoint], len(starts)
+
+    def read(self, meters, start, stop):
+        columns = []
+        for m in meters:
+            with open(self.paths[m], 'rb') as f:
+                names = f.readline().decode().strip().split(',')
+                f.seek(self.offsets[m][start // self.checkpoint])
+                column = pd.read_csv(f, header=None, names=names, index_col=0,
+                                     parse_dates=True, skiprows=start % self.checkpoint,
+                                     nrows=stop - start)
+            columns.append(column.squeeze('columns').rename(m))
+        return pd.concat(columns, axis=1)
+
+
+def _week_slots(values, start, complete, samples_in_week):
+    """ sums of values per average-week slot, rows from position start on,
+    only rows before `complete` (the end of the last complete week) count. """
+    slots = np.zeros((samples_in_week, values.shape[1]))
+    values = np.nan_to_num(values[:max(0, complete - start)])
+    i = 0
+    while i < len(values):
+        slot = (start + i) % samples_in_week
+        take = min(samples_in_week - slot, len(values) - i)
+        slots[slot:slot + take] += values[i:i + take]
+        i += take
+    return slots
+
+
+def block_partial(source, meters, start, stop, samples_in_week, complete, spill_dir):
+    """ partial aggregate of rows start:stop of meters, pickled to spill_dir.
+    returns the path of the spilled partial. """
+    frame = source.read(meters, start, stop)
+    values = frame.values.astype(np.float64)
+    daily = frame.resample('D')
+    partial = {
+        'cells': CellAggregate.from_values(values, calendar_codes(frame.index)),
+        'daily_sum': daily.sum(), 'daily_min': daily.min(), 'daily_max': daily.max(),
+        'weekly': frame.resample('W').sum(),
+        'week_slots': (_week_slots(values, start, complete, samples_in_week)
+                       if samples_in_week else None),
+        'zeros': (values == 0).sum(axis=0),
+        'diff': np.nansum(np.abs(np.diff(values, axis=0)), axis=0),
+        'first': values[0], 'last': values[-1]}
+    path = os.path.join(spill_dir, f'{meters[0]}-{start}.pkl')
+    with open(path, 'wb') as f:
+        pickle.dump(partial, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def _by_label(a, b, reduce):
+    return pd.concat([a, b]).groupby(level=0).agg(reduce)
+
+
+def merge_partials(a, b):
+    """ partial aggregate of two consecutive blocks of rows (a before b). """
+    bridge = np.abs(b['first'] - a['last'])
+    return {
+        'cells': a['cells'].merge(b['cells']),
+        'daily_sum': _by_label(a['daily_sum'], b['daily_sum'], 'sum'),
+        'daily_min': _by_label(a['daily_min'], b['daily_min'], 'min'),
+        'daily_max': _by_label(a['daily_max'], b['daily_max'], 'max'),
+        'weekly': _by_label(a['weekly'], b['weekly'], 'sum'),
+        'week_slots': (None if a['week_slots'] is None
+                       else a['week_slots'] + b['week_slots']),
+        'zeros': a['zeros'] + b['zeros'],
+        'diff': a['diff'] + b['diff'] + np.where(np.isnan(bridge), 0, bridge),
+        'first': a['first'], 'last': b['last']}
+
+
+def _average_week_features(average_week, samples_in_day, weekdays):
+    weekends = ~weekdays
+    return {
+        's_max': average_week.max(axis=0), 's_min': average_week.min(axis=0),
+        's_wd_min': average_week[weekdays].min(axis=0),
+        's_wd_max': average_week[weekdays].max(axis=0),
+        's_we_min': average_week[weekends].min(axis=0),
+        's_we_max': average_week[weekends].max(axis=0),
+        't_above_mean': (average_week > average_week.mean(axis=0)).sum(axis=0),
+        't_daily_max': np.argmax(average_week[:samples_in_day], axis=0),
+        't_daily_min': np.argmin(average_week[:samples_in_day], axis=0)}
+
+
+def partial_features(partial, periods, granularity, first_week):
+    """ {feature: (meters,) array} of a merged partial aggregate. first_week are the
+    timestamps of the first samples_in_week rows. """
+    with np.errstate(all='ignore'):
+        daily_sum = partial['daily_sum'].values
+        daily_min = partial['daily_min'].values
+        features = {
+            'c_week': np.nanmean(partial['weekly'].values, axis=0),
+            'c_max_avg': np.nanmean(partial['daily_max'].values, axis=0),
+            'c_min_avg': np.nanmean(daily_min, axis=0),
+            'c_base_guess': np.nanmedian(daily_min, axis=0),
+            'MinMax': np.nanmin(daily_sum, axis=0)/np.nanmax(daily_sum, axis=0),
+            's_diff': partial['diff'], 's_number_zeros': partial['zeros']}
+        if partial['week_slots'] is not None and first_week is not None:
+            average_week = partial['week_slots']/partial['n_weeks']
+            features.update(_average_week_features(
+                average_week, int(24*60/granularity), first_week.weekday < 5))
+        features.update(cell_features(partial['cells'], periods, granularity, features))
+    return {f: v for f, v in features.items()
+            if Extractor.features_min_granularity.get(f, np.inf) >= granularity}
+
+
+CHUNKED_FEATURES = sorted(
+    set(MEANS) | set(VARIANCES) | set(MINIMA) | set(MAXIMA) | set(RATIOS)
+    | set(NO_MIN) | set(RATIOS_NO_MIN)
+    | {'r_min_wd_we', 'c_ht_var', 'c_week', 'c_max_avg', 'c_min_avg', 'c_base_guess',
+       'MinMax', 's_diff', 's_number_zeros', 's_max', 's_min', 's_wd_min', 's_wd_max',
+       's_we_min', 's_we_max', 't_above_mean', 't_daily_max', 't_daily_min'})
+
+
+class ChunkedExtractor:
+    def __init__(self, source, periods, meters_per_block=256, rows_per_block=4*24*7*13,
+                 workers=None, spill_dir=None):
+        self.source = source
+        self.periods = periods
+        self.meters_per_block = meters_per_block
+        self.rows_per_block = rows_per_block
+        self.workers = workers or os.cpu_count()
+        self.spill_dir = spill_dir
+        head = source.read(source.meters[:1], 0, 2)
+        self.start = head.index[0]
+        self.granularity = (head.index[1] - head.index[0]).total_seconds()/60.0
+
+    def _extract_available(self, details=True):
+        self._extract(CHUNKED_FEATURES, details)
+
+    def _extract(self, features, details=True):
+        """ extract features for all meters of the source. self.extracted is a
+        DataFrame (meters x features), features that can not be computed in chunks
+        or need finer data are in self.unavailable. """
+        self.unavailable = {}
+        self.unavailable_details = {}
+        for f in features:
+            if f not in CHUNKED_FEATURES:
+                self.unavailable[f] = Reason.NOT_IMPLEMENTED
+                if details:
+                    self.unavailable_details[f] = f'{f} not implemented in chunks'
+            elif Extractor.features_min_granularity.get(f, np.inf) < self.granularity:
+                self.unavailable[f] = Reason.GRANULARITY
+                if details:
+                    self.unavailable_details[f] = (
+                        f'{f} needs granularity less than '
+                        f'{Extractor.features_min_granularity[f]} min')
+        wanted = [f for f in features if f not in self.unavailable]
+
+        meters = self.source.meters
+        groups = [meters[i:i + self.meters_per_block]
+                  for i in range(0, len(meters), self.meters_per_block)]
+        starts = range(0, self.source.length, self.rows_per_block)
+        samples_in_week = (int(7*24*60/self.granularity)
+                           if self.granularity <= 7*24*60 else 0)
+        n_weeks = self.source.length // samples_in_week if samples_in_week else 0
+        first_week = (pd.date_range(self.start, periods=samples_in_week,
+                                    freq=pd.Timedelta(minutes=self.granularity))
+                      if n_weeks else None)
+
+        spill_dir = tempfile.mkdtemp(prefix='chunks-', dir=self.spill_dir)
+        columns = {f: [] for f in wanted}
+        try:
+            with ProcessPoolExecutor(self.workers) as pool:
+                spilled = [[pool.submit(block_partial, self.source, group, start,
+                                        min(start + self.rows_per_block, self.source.length),
+                                        samples_in_week, n_weeks*samples_in_week, spill_dir)
+                            for start in starts]
+                           for group in groups]
+                for blocks in spilled:
+                    partial = None
+                    for block in blocks:
+                        path = block.result()
+                        with open(path, 'rb') as f:
+                            part = pickle.load(f)
+                        os.remove(path)
+                        partial = part if partial is None else merge_partials(partial, part)
+                    partial['n_weeks'] = n_weeks
+                    computed = partial_features(
+                        partial, self.periods, self.granularity, first_week)
+                    for f in wanted:
+                        columns[f].append(computed.get(
+                            f, np.full(len(partial['zeros']), np.nan)))
+        finally:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+        self.extracted = pd.DataFrame(
+            {f: np.concatenate(v).astype(np.float64) for f, v in columns.items()},
+            index=pd.Index(meters, name='id'))
@@ -0,0 +1,261 @@
+""" per feature equivalence of the fast extraction paths with Extractor.
+
+every engine extracts the features it supports for a set of households, the
+reference Extractor extracts the same features for the same households, and
+availability is compared before the values: a feature the reference has for
+a household and the engine has not (or the reverse) is a violation. engines
+built on Extractor (float32) say which features are unavailable, the batch
+engines give nan for a feature not defined for a meter, so for them nan is
+unavailable (for the reference too). where both have the feature, both nan
+is equal, otherwise the relative error has to be within the tolerance. a
+feature an engine does not compute at all is reported as unsupported. the
+speedup is the time of the reference over the time of the engine, on the
+engine's features.
+
+households are data/consumption.csv with data/temperature.csv and synthetic
+edge cases derived from it: gaps (missing days and scattered nan), zeros
+(a vacation of zeros and scattered zero readings), flat (one constant
+value), hourly and daily granularity, short (10 days, partial weeks) and
+bare (no period config).
+with --copies n every household is there n times, scaled, to time engines
+on a larger fleet.
+
+engines:
+- float32: Extractor(precision='float32'),
+- fleet: FleetExtractor, its vectorized features, households on one grid together,
+- chunked: ChunkedExtractor on a FrameSource,
+- rolling: rolling_features with one window over all days,
+- shared: SharedExtractor on a SharedFleet.
+
+    python equivalence_check.py [--engines fleet chunked] [--tolerance 1e-7] [--copies 1]
+"""
+import argparse
+import json
+import math
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from chunkedExtractor import CHUNKED_FEATURES, ChunkedExtractor, FrameSource
+from featureExtractor import Extractor
+from fleetExtractor import FEATURES, FleetExtractor
+from rollingExtractor import rolling_features
+from sharedFleet import SharedExtractor, SharedFleet
+
+# relative tolerance per engine: float32 rounds the readings (relative error ~6e-8),
+# which the hockey stick fit and the fourth moment (kurtosis) amplify
+TOLERANCES = {'float32': 1e-5}
+# tolerances of features that are known to differ more, per engine (precision_check)
+KNOWN = {'float32': {'t_width_peaks': 1e-3, 'hockeyStickDependency': 1e-3}}
+
+
+def households(consumption, temperature, periods, copies=1):
+    """ {name: data} of the real household and the synthetic edge cases, copies
+    times ('real', 'real-1', ...), copy i scaled by 1 + i/100. """
+    rng = np.random.default_rng(0)
+    gaps = consumption.copy()
+    gaps.iloc[4*24*30:4*24*33] = np.nan
+    gaps.iloc[rng.choice(len(gaps), len(gaps)//100, replace=False)] = np.nan
+    zeros = consumption.copy()
+    zeros.iloc[4*24*60:4*24*120] = 0
+    zeros.iloc[rng.choice(len(zeros), len(zeros)//20, replace=False)] = 0
+    flat = pd.Series(250.0, index=consumption.index)
+    short = consumption.iloc[:4*24*10]
+    hourly = (consumption.resample('h').sum(), temperature.resample('h').mean())
+    daily = (consumption.resample('D').sum(), temperature.resample('D').mean())
+    series = {'real': (consumption, temperature), 'gaps': (gaps, temperature),
+              'zeros': (zeros, temperature), 'flat': (flat, temperature),
+              'short': (short, temperature), 'hourly': hourly, 'daily': daily}
+    data = {}
+    for i in range(copies):
+        for name, (c, t) in series.items():
+            name = f'{name}-{i}' if i else name
+            data[name] = dict(periods, id=name, consumption=c*(1 + i/100), temperature=t)
+        name = f'bare-{i}' if i else 'bare'
+        data[name] = dict(id=name, consumption=consumption*(1 + i/100), temperature=temperature)
+    return data
+
+
+def _periods(d):
+    return {k: v for k, v in d.items()
+            if k != 'id' and not isinstance(v, (pd.Series, pd.DataFrame))}
+
+
+def _grids(data):
+    """ [(names, consumption DataFrame, temperature, periods)] of households on one
+    time grid with one period config. """
+    groups = []
+    for name, d in data.items():
+        for names, frames, _, periods in groups:
+            if frames[0].index.equals(d['consumption'].index) and periods == _periods(d):
+                names.append(name)
+                frames.append(d['consumption'])
+                break
+        else:
+            groups.append(([name], [d['consumption']], d['temperature'], _periods(d)))
+    return [(names, pd.concat(frames, axis=1, keys=names), t, periods)
+            for names, frames, t, periods in groups]
+
+
+def _extractors(data, features, **options):
+    """ (values, available) DataFrames (households x features) of Extractor,
+    available is whether the extractor has the feature. """
+    rows, available = {}, {}
+    for name, d in data.items():
+        extractor = Extractor(d, **options)
+        extractor._extract(features, details=False)
+        rows[name] = {f: extractor.features.get(f, np.nan) for f in features}
+        available[name] = {f: f in extractor.features for f in features}
+    return (pd.DataFrame.from_dict(rows, orient='index'),
+            pd.DataFrame.from_dict(available, orient='index'))
+
+
+def reference(data, features):
+    return _extractors(data, features)
+
+
+def float32(data, features):
+    return _extractors(data, features, precision='float32')
+
+
+# batch engines return (values, None): a column for every feature they compute,
+# nan where a feature is unavailable
+
+def fleet(data, features):
+    supported = [f for f in features if f in FEATURES]
+    parts = []
+    for names, frame, temperature, periods in _grids(data):
+        extractor = FleetExtractor(dict(periods, consumption=frame,
+                                        temperature=temperature))
+        extractor._extract(supported, details=False)
+        parts.append(extractor.extracted)
+    return pd.concat(parts).reindex(columns=supported), None
+
+
+def chunked(data, features):
+    supported = [f for f in features if f in CHUNKED_FEATURES]
+    parts = []
+    for names, frame, _, periods in _grids(data):
+        extractor = ChunkedExtractor(FrameSource(frame), periods, workers=1)
+        extractor._extract(supported, details=False)
+        parts.append(extractor.extracted)
+    return pd.concat(parts).reindex(columns=supported), None
+
+
+def rolling(data, features):
+    rows = {}
+    for name, d in data.items():
+        index = d['consumption'].index
+        days = (index[-1].normalize() - index[0].normalize()).days + 1
+        rows[name] = rolling_features(d, window=days).iloc[-1]
+    values = pd.DataFrame.from_dict(rows, orient='index')
+    return values.reindex(columns=[f for f in features if f in values.columns]), None
+
+
+def shared(data, features):
+    parts = []
+    for names, frame, temperature, periods in _grids(data):
+        with SharedFleet(frame, temperature) as fleet:
+            extractor = SharedExtractor(fleet, periods, workers=2)
+            extractor._extract(features, details=False)
+            parts.append(extractor.extracted)
+    return pd.concat(parts).reindex(columns=features), None
+
+
+ENGINES = {'float32': float32, 'fleet': fleet, 'chunked': chunked,
+           'rolling': rolling, 'shared': shared}
+
+
+def relative_error(a, b):
+    a, b = float(a), float(b)
+    if math.isnan(a) and math.isnan(b):
+        return 0.0
+    if math.isnan(a) or math.isnan(b):
+        return math.inf
+    return abs(a - b)/max(abs(a), 1e-12)
+
+
+def compare(engine, data, features, tolerance, absolute):
+    """ (violations, unsupported features, seconds of the reference, of the engine).
+    violations are (household, feature, reference, engine, relative error), the
+    value is None where a feature is unavailable. """
+    started = time.perf_counter()
+    candidate, candidate_available = ENGINES[engine](data, features)
+    seconds = time.perf_counter() - started
+    supported = [f for f in features if f in candidate.columns]
+    started = time.perf_counter()
+    expected, expected_available = reference(data, supported)
+    reference_seconds = time.perf_counter() - started
+    if candidate_available is None:
+        # batch engines: nan is unavailable
+        candidate_available = candidate.notna()
+        expected_available = expected_available & expected.notna()
+
+    known = KNOWN.get(engine, {})
+    tolerance = max(tolerance, TOLERANCES.get(engine, 0))
+    violations = []
+    for name in data:
+        for f in supported:
+            a, b = expected.at[name, f], candidate.at[name, f]
+            has_a, has_b = expected_available.at[name, f], candidate_available.at[name, f]
+            if has_a != has_b:
+                violations.append((name, f, float(a) if has_a else None,
+                                   float(b) if has_b else None, math.inf))
+                continue
+            if not has_a:
+                continue
+            error = relative_error(a, b)
+            if error > known.get(f, tolerance) and not abs(float(a) - float(b)) <= absolute:
+                violations.append((name, f, float(a), float(b), error))
+    return violations, sorted(set(features) - set(supported)), reference_seconds, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--consumption', default='data/consumption.csv')
+    parser.add_argument('--temperature', default='data/temperature.csv')
+    parser.add_argument('--periods', default='data/periods.json')
+    parser.add_argument('--engines', nargs='+', choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument('--tolerance', type=float, default=1e-7,
+                        help='relative tolerance (float32: 1e-5)')
+    parser.add_argument('--absolute', type=float, default=1e-8,
+                        help='values closer than this are equal')
+    parser.add_argument('--copies', type=int, default=1)
+    parser.add_argument('--show', type=int, default=20, help='violations shown per engine')
+    args = parser.parse_args()
+
+    warnings.filterwarnings('ignore')
+    with open(args.periods) as f:
+        periods = json.load(f)
+    consumption = pd.read_csv(
+        args.consumption, parse_dates=True, index_col=0).squeeze('columns')
+    temperature = pd.read_csv(
+        args.temperature, parse_dates=True, index_col=0).squeeze('columns')
+    data = households(consumption, temperature, periods, args.copies)
+    features = Extractor.features_defined
+
+    failed = False
+    print(f'{"engine":10s} {"features":>8s} {"violations":>10s} {"reference s":>11s} '
+          f'{"engine s":>9s} {"speedup":>8s}')
+    reports = {}
+    for engine in args.engines:
+        violations, unsupported, reference_seconds, seconds = compare(
+            engine, data, features, args.tolerance, args.absolute)
+        reports[engine] = violations, unsupported
+        print(f'{engine:10s} {len(features) - len(unsupported):8d} {len(violations):10d} '
+              f'{reference_seconds:11.2f} {seconds:9.2f} {reference_seconds/seconds:7.1f}x')
+        failed |= bool(violations)
+    for engine, (violations, unsupported) in reports.items():
+        if violations:
+            print(f'\n{engine}: {len(violations)} violations')
+            for name, f, a, b, error in violations[:args.show]:
+                a, b = ('unavailable' if v is None else f'{v:.10g}' for v in (a, b))
+                print(f'  {name:8s} {f:30s} {a:>20s} {b:>20s} {error:9.2e}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -18,4 +18,5 @@ extractor._extract(['asc', 'skewness', 'kurtosis',
                     'MinMax', 'nonExistantFeature', 'k'])
 
 print(f'Available: {extractor.extracted}')
-print(f'Unavailable: {extractor.unavailable}')
+for f, reason in extractor.unavailable.items():
+    print(f'Unavailable: {f} ({reason.name}) {extractor.unavailable_details[f]}')
@@ -21,6 +21,6 @@ for k in extractor.extracted:
     print(f'{k}: {extractor.extracted[k]}')
 
 # imena neuspesno ekstrahiranih znacilk in razlogi za neuspeh se shranijo v
-# slovar extractor._unavailable
-for f in extractor.unavailable:
-    print(f)
+# slovar extractor.unavailable (podrobnosti v extractor.unavailable_details)
+for f, reason in extractor.unavailable.items():
+    print(f'{f}: {reason.name} {extractor.unavailable_details[f]}')
@@ -9,12 +9,15 @@ consumption = pd.read_csv('data/consumption.csv',
 temperature = pd.read_csv('data/temperature.csv',
                           parse_dates=True, index_col=0).squeeze()
 
-data['consumption'] = consumption.resample('D').sum()
-data['temperature'] = temperature.resample('D').sum()
+data['consumption'] = consumption
+data['temperature'] = temperature
 
 extractor = Extractor(data)
 
-extractor._extract_available()
+# vse znacilke na dnevnih podatkih, ki se izracunajo iz 15 minutnih (brez
+# dodatnega Extractor-ja in ponovnega resample-a)
+extractor._extract_resolutions({f: 24*60 for f in extractor.features_defined})
 
 print(f'Available: {extractor.extracted}')
-print(f'Unavailable: {extractor.unavailable}')
+for f, reason in extractor.unavailable.items():
+    print(f'Unavailable: {f} ({reason.name}) {extractor.unavailable_details[f]}')
@@ -54,5 +54,5 @@ extractor._extract(['asc', 'skewness', 'kurtosis', 'MinMax', 'lala'])
 
 for f in extractor.extracted:
     print(f'{f} {extractor.extracted[f]}')
-for f in extractor.unavailable:
-    print(f'{f}')
+for f, reason in extractor.unavailable.items():
+    print(f'{f} {reason.name}')
@@ -0,0 +1,209 @@
+""" extract features for many meters from the command line.
+
+inputs are csv files with the layout of data/consumption.csv (time index, one
+column per meter, the column name is the meter id) or directories of such
+files. files are extracted in parallel, at most 2*workers at a time, and rows
+are written as soon as they are done. progress and throughput go to stderr.
+
+    python extract_features.py data/meters/ --periods data/periods.json \
+        --features data/features_to_extract.csv --temperature data/temperature.csv \
+        --workers 8 --output features_extracted.csv
+
+an output ending in '.csv' is written like data/features_extracted.csv, any
+other output with FeatureWriter ('.parquet' or a directory of npz parts).
+"""
+import argparse
+import csv
+import glob
+import json
+import logging
+import os
+import sys
+import time
+import warnings
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pandas as pd
+
+from featureExtractor import Extractor, count_unavailable, load_priors
+from featureWriter import FeatureWriter
+
+log = logging.getLogger('extract_features')
+
+_temperatures = {}
+_priors = {}
+
+
+def input_files(inputs):
+    """ csv files of the given files and directories, in a stable order. """
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.csv'))))
+        else:
+            files.append(path)
+    return files
+
+
+def _start_worker(priors):
+    _priors.update(priors)
+
+
+def extract_file(path, periods, features, temperature=None, limits={}, priors=None):
+    """ [(meter id, features, unavailable reasons, fits)] for every column of one
+    file. limits are the time and iteration budgets of Extractor._extract, priors
+    the {meter id: prior} of load_priors the k1 fits start from, by default the
+    ones the worker was started with. """
+    warnings.filterwarnings('ignore')
+    frame = pd.read_csv(path, parse_dates=True, index_col=0)
+    if temperature is not None and temperature not in _temperatures:
+        _temperatures[temperature] = pd.read_csv(
+            temperature, parse_dates=True, index_col=0).squeeze('columns')
+    priors = _priors if priors is None else priors
+    rows = []
+    for meter in frame.columns:
+        data = dict(periods)
+        data['id'] = str(meter)
+        data['consumption'] = frame[meter]
+        if temperature is not None:
+            data['temperature'] = _temperatures[temperature]
+        if str(meter) in priors:
+            data['priors'] = priors[str(meter)]
+        extractor = Extractor(data)
+        extractor._extract(features, details=False, **limits)
+        rows.append((str(meter),
+                     {f: extractor.features[f] for f in features if f in extractor.features},
+                     extractor.unavailable,
+                     extractor.fits))
+    return rows
+
+
+class CsvOutput:
+    """ rows like data/features_extracted.csv, written as they arrive. """
+
+    def __init__(self, path, features):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(['id'] + features)
+        self.features = features
+
+    def append(self, id, extracted):
+        self.writer.writerow([id] + [repr(float(extracted[f])) if f in extracted else ''
+                                     for f in self.features])
+
+    def close(self):
+        self.file.close()
+
+
+def read_features(path):
+    """ feature names, one per line (like data/features_to_extract.csv). """
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('inputs', nargs='+', help='csv files or directories of csv files')
+    parser.add_argument('--periods', default='data/periods.json')
+    parser.add_argument('--features', help='file with one feature per line '
+                        '(default: all features)')
+    parser.add_argument('--temperature')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--feature-budget', type=float,
+                        help='seconds per feature, slower features are unavailable')
+    parser.add_argument('--household-budget', type=float, help='seconds per meter')
+    parser.add_argument('--max-iterations', type=int,
+                        help='function evaluations of iterative fits (k1)')
+    parser.add_argument('--priors', help='features csv of an earlier run, '
+                        'k1 fits start from its k1, n1, k2, n2')
+    parser.add_argument('--progress', type=float, default=5.0,
+                        help='seconds between progress reports')
+    args = parser.parse_args()
+
+    # progress of this script, not the per feature messages of Extractor
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr,
+                        format='%(asctime)s %(message)s')
+    log.setLevel(logging.INFO)
+    with open(args.periods) as f:
+        periods = json.load(f)
+    features = read_features(args.features) if args.features else Extractor.features_defined
+    unknown = [f for f in features if f not in Extractor.features_defined]
+    if unknown:
+        log.warning(f'not implemented: {", ".join(unknown)}')
+    files = input_files(args.inputs)
+    priors = {}
+    if args.priors is not None:
+        if not os.path.isfile(args.priors):
+            parser.error(f'--priors: {args.priors} does not exist')
+        priors = load_priors(args.priors)
+        if not priors:
+            log.warning(f'no meters with k1, n1, k2 and n2 in {args.priors}')
+    limits = {'feature_budget': args.feature_budget,
+              'household_budget': args.household_budget,
+              'max_iterations': args.max_iterations}
+    output = (CsvOutput(args.output, features) if args.output.endswith('.csv')
+              else FeatureWriter(args.output, features))
+
+    started = last = time.perf_counter()
+    meters = done = failed = 0
+    unavailable = count_unavailable([])
+    fits = {}
+    pending = {}
+    queue = iter(files)
+    # priors go to every worker once, not with every file
+    with ProcessPoolExecutor(args.workers, initializer=_start_worker,
+                             initargs=(priors,)) as pool:
+        while True:
+            # keep at most 2*workers files in flight, so memory stays bounded
+            for path in queue:
+                future = pool.submit(extract_file, path, periods, features,
+                                     args.temperature, limits)
+                pending[future] = path
+                if len(pending) >= 2*args.workers:
+                    break
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                path = pending.pop(future)
+                done += 1
+                try:
+                    rows = future.result()
+                except Exception:
+                    log.exception(f'extraction of {path} failed')
+                    failed += 1
+                    continue
+                for id, extracted, reasons, fitted in rows:
+                    output.append(id, extracted)
+                    for f, fit in fitted.items():
+                        fits.setdefault(f, []).append(fit)
+                unavailable = unavailable.add(
+                    count_unavailable(reasons for _, _, reasons, _ in rows), fill_value=0)
+                meters += len(rows)
+            now = time.perf_counter()
+            if now - last >= args.progress or not pending:
+                last = now
+                log.info(f'{done}/{len(files)} files, {meters} meters, '
+                         f'{meters/(now - started):.1f} meters/s')
+    output.close()
+
+    for (f, reason), count in unavailable.stack().items():
+        if count:
+            log.info(f'unavailable: {f} ({reason.lower()}) for {count:.0f} meters')
+    timeouts = unavailable['TIMEOUT'].sum()
+    if timeouts:
+        log.info(f'{timeouts:.0f} features over budget')
+    for f, done_fits in sorted(fits.items()):
+        evaluations = sum(fit['evaluations'] for fit in done_fits)
+        warm = sum(fit['start'] == 'prior' for fit in done_fits)
+        fallback = sum(fit['prior'] and fit['start'] != 'prior' for fit in done_fits)
+        log.info(f'{f}: {len(done_fits)} fits, {evaluations/len(done_fits):.0f} evaluations '
+                 f'on average, {warm} from priors, {fallback} priors did not converge')
+    log.info(f'{meters} meters in {time.perf_counter() - started:.1f} s, '
+             f'{failed} files failed')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,22 @@
-import logging
 import functools
+import enum
+import importlib
+import signal
+import threading
+import time
+from collections import Counter
+from collections.abc import Mapping
 
 import numpy as np
 import pandas as pd
-import json
-from scipy.optimize import curve_fit
-from scipy.signal import correlate, find_peaks, peak_widths, argrelextrema
-from scipy.ndimage import uniform_filter1d
+
+from kernels import (masked_mean, masked_var, masked_sqdev, masked_min, masked_max,
+                     masked_sum, masked_count, masked_argmax, masked_argmin)
+from temperatureCache import TemperatureCache, x_sums
+import runLength
+
+# temperature data shared by the meters of a region, see temperatureCache
+temperature_cache = TemperatureCache()
 
 
 def line(X, k, n):
@@ -18,6 +28,103 @@ def hockeyStick(X, k1, n1, k2, n2):
     return np.array([k1*x + n1 if x < lowpoint else k2*x + n2 for x in X])
 
 
+# hour and weekday of each calendar code (weekday*24 + hour)
+_CELL_HOURS = (np.arange(7*24) % 24).astype(np.uint8)
+_CELL_DAYS = (np.arange(7*24) // 24).astype(np.uint8)
+
+
+def _hour_mask(start, end):
+    """ bool lookup table of calendar codes with start <= hour < end. """
+    return (_CELL_HOURS >= start) & (_CELL_HOURS < end)
+
+
+def line_fits(x, y, groups, sums=None):
+    """ least squares k, n of y = k*x + n for every group, from the sufficient
+    statistics (count, sum x, sum y, sum xy, sum x^2) instead of an optimizer.
+    x and y are (time,) or (time, meters) arrays, groups a (groups, time) bool
+    array; pairs with a nan are skipped. sums are the x_sums of x when they are
+    already known (pairs are valid wherever x is). returns k, n of shape
+    (groups,) or (groups, meters), nan where a group has less than two distinct x. """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    one_meter = x.ndim == 1 and y.ndim == 1
+    x, y = np.broadcast_arrays(x.reshape(len(x), -1), y.reshape(len(y), -1))
+    valid = ~np.isnan(x) & ~np.isnan(y)
+    # shift by the means so the sums don't cancel
+    x0, x, n, sx, sxx = sums if sums is not None else x_sums(x, valid, groups)
+    y0 = np.nanmean(np.where(valid, y, np.nan), axis=0)
+    y = np.where(valid, y - y0, 0)
+
+    g = np.asarray(groups, dtype=np.float64)
+    k, intercept = line_from_sums(x0, y0, n, sx, g @ y, g @ (x*y), sxx)
+    if one_meter:
+        return k[:, 0], intercept[:, 0]
+    return k, intercept
+
+
+def line_from_sums(x0, y0, n, sx, sy, sxy, sxx):
+    """ k, n of the least squares lines of groups with the given sums of x - x0 and
+    y - y0, nan where a group has less than two distinct x. """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k = (n*sxy - sx*sy)/(n*sxx - sx*sx)
+        intercept = (sy - k*sx)/n + y0 - k*x0
+    k[n < 2] = np.nan
+    intercept[np.isnan(k)] = np.nan
+    return k, intercept
+
+
+def fit_temperature(temperature, consumption, groups):
+    """ line fits of consumption against temperature for every group in
+    {name: bool mask over consumption samples}. consumption is a Series or a
+    DataFrame of meters, temperature is aligned to its index once.
+    returns {name: (k, n)}. """
+    x = temperature.reindex(consumption.index).values
+    k, n = line_fits(x, consumption.values, np.array(list(groups.values())))
+    return {name: (k[i], n[i]) for i, name in enumerate(groups)}
+
+
+def fit_daily_temperature(temperature, consumption, daily_minima=None):
+    """ line fits of daily consumption minima ('minima') and maxima ('maxmin')
+    against daily temperature minima, both in one pass. daily_minima(days)
+    returns the temperature minima on the days when they are already known. """
+    daily = consumption.resample('D')
+    c_min, c_max = daily.min(), daily.max()
+    if daily_minima is not None:
+        x = daily_minima(c_min.index)
+    else:
+        x = temperature.resample('D').min().reindex(c_min.index).values
+    y = np.concatenate([c_min.values.reshape(len(x), -1),
+                        c_max.values.reshape(len(x), -1)], axis=1)
+    k, n = line_fits(x, y, np.ones((1, len(x)), dtype=bool))
+    m = y.shape[1]//2
+    if consumption.ndim == 1:
+        return {'minima': (k[0, 0], n[0, 0]), 'maxmin': (k[0, 1], n[0, 1])}
+    return {'minima': (k[0, :m], n[0, :m]), 'maxmin': (k[0, m:], n[0, m:])}
+
+
+# parameters of the hockey stick fit (k1), in the order of hockeyStick
+HOCKEY_STICK = ['k1', 'n1', 'k2', 'n2']
+
+
+def load_priors(path):
+    """ {meter id: {'k1', 'n1', 'k2', 'n2'}} from the features csv of an earlier
+    run (layout of data/features_extracted.csv), for meters where all are known.
+    given as data['priors'], they are the starting point of the k1 fit. """
+    if not set(HOCKEY_STICK) <= set(pd.read_csv(path, nrows=0).columns):
+        return {}
+    frame = pd.read_csv(path, usecols=['id'] + HOCKEY_STICK, index_col='id',
+                        dtype={'id': str}, float_precision='round_trip')
+    return frame.dropna().to_dict(orient='index')
+
+
+def _slope(fits, group, feature):
+    k, n = fits[group]
+    if np.isnan(k):
+        raise FeatureUnavailable(
+            Reason.NUMERIC, f'{feature}: not enough data for a line fit')
+    return k, n
+
+
 def dropna_and_index_intersect(df1, df2):
     i1 = df1.dropna().index
     i2 = df2.dropna().index
@@ -25,49 +132,332 @@ def dropna_and_index_intersect(df1, df2):
     return df1.loc[inBoth], df2.loc[inBoth]
 
 
-class Extractor:
-    def __init__(self, data={}, main='consumption'):
+class Reason(enum.IntEnum):
+    """ why a feature is unavailable. """
+    GRANULARITY = 1
+    MISSING_DATA = 2
+    NUMERIC = 3
+    NOT_IMPLEMENTED = 4
+    TIMEOUT = 5
+
+
+class FeatureUnavailable(Exception):
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+class _Timeout(BaseException):
+    """ raised by _Timer when a time budget runs out. not an Exception, so code
+    that catches Exception does not swallow it. """
+
+
+# modules features import on first use, imported before a time budget starts so
+# that the import is not counted to (or interrupted by) the first feature's budget
+_LAZY_IMPORTS = ['scipy.optimize', 'scipy.signal', 'scipy.ndimage']
+
+
+def _info(message):
+    """ logging.info, logging is imported with the first message. """
+    import logging
+    logging.info(message)
+
+
+def _import_lazy_modules():
+    for module in _LAZY_IMPORTS:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            # the features that need it fail on their own
+            pass
+
+
+class _Timer:
+    """ raises _Timeout after the given seconds, with signal.setitimer. only in the
+    main thread (and where setitimer exists), elsewhere it does nothing and time
+    budgets are only checked between features and by the features' own checks
+    (Extractor._check_deadline). the handler and timer that were set before are
+    restored on exit. """
+
+    def __init__(self, enabled):
+        self.enabled = (enabled and hasattr(signal, 'setitimer')
+                        and threading.current_thread() is threading.main_thread())
+
+    def __enter__(self):
+        if self.enabled:
+            _import_lazy_modules()
+            self.previous_timer = signal.setitimer(signal.ITIMER_REAL, 0)
+            self.entered = time.perf_counter()
+            self.previous = signal.signal(signal.SIGALRM, self._alarm)
+        return self
+
+    def _alarm(self, signum, frame):
+        raise _Timeout()
+
+    def start(self, seconds):
+        if self.enabled and seconds is not None:
+            signal.setitimer(signal.ITIMER_REAL, max(seconds, 1e-6))
+
+    def stop(self):
+        if self.enabled:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+    def __exit__(self, *exc):
+        if self.enabled:
+            self.stop()
+            signal.signal(signal.SIGALRM, self.previous)
+            delay, interval = self.previous_timer
+            if delay > 0:
+                # what is left of the previous timer, due ones fire right away
+                elapsed = time.perf_counter() - self.entered
+                signal.setitimer(signal.ITIMER_REAL, max(delay - elapsed, 1e-6), interval)
+
+
+def _reason(e):
+    if isinstance(e, FeatureUnavailable):
+        return e.reason
+    if isinstance(e, KeyError):
+        return Reason.MISSING_DATA
+    return Reason.NUMERIC
+
+
+def count_unavailable(unavailables):
+    """ fleet level counts of unavailable features, DataFrame of feature x reason.
+    unavailables is an iterable of extractor.unavailable dicts. """
+    counts = Counter()
+    for unavailable in unavailables:
+        counts.update(unavailable.items())
+    counts = pd.Series(counts, dtype=int)
+    if counts.empty:
+        return pd.DataFrame(columns=[r.name for r in Reason], dtype=int)
+    counts = counts.unstack(fill_value=0)
+    counts.columns = [Reason(r).name for r in counts.columns]
+    return counts.reindex(columns=[r.name for r in Reason], fill_value=0)
+
+
+class LazyFeatures(Mapping):
+    """ features of one extractor, each computed with its dependencies on first
+    access and memoized. iterating computes all of them. pickling keeps only the
+    materialized features, not the extractor and its data. """
+
+    def __init__(self, extractor):
+        self._extractor = extractor
+        self._features = extractor.features
+        self.unavailable = {}
+
+    def __getitem__(self, name):
+        if name not in self._features:
+            if name in self.unavailable:
+                raise KeyError(f'{name} unavailable: {self.unavailable[name].name}')
+            if self._extractor is None:
+                raise KeyError(f'{name} was not materialized')
+            if name not in self._extractor.features_defined:
+                raise KeyError(f'{name} not implemented')
+            try:
+                getattr(self._extractor, name)()
+            except Exception as e:
+                self.unavailable[name] = _reason(e)
+                raise KeyError(f'{name} unavailable: {self.unavailable[name].name}')
+        return self._features[name]
 
-        self.data = data
+    def __iter__(self):
+        if self._extractor is not None:
+            for name in self._extractor.features_defined:
+                self.get(name)
+        return iter(list(self._features))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def materialized(self):
+        """ features computed so far, without computing anything. """
+        return dict(self._features)
+
+    def __getstate__(self):
+        return {'_extractor': None, '_features': dict(self._features),
+                'unavailable': self.unavailable}
+
+    def __repr__(self):
+        return f'LazyFeatures({self.materialized()})'
+
+
+class Extractor:
+    def __init__(self, data={}, main='consumption', precision='float64'):
+
+        # own copy, so derived data is not added to (and kept alive by) the caller's dict
+        self.data = dict(data)
+        self.precision = precision
+        # key of the temperature in temperature_cache, before any conversion
+        self.region = data.get('region', id(data.get('temperature')))
+        if precision == 'float32':
+            # readings are stored as float32, reductions accumulate in float64
+            if 'consumption' in self.data:
+                self.data['consumption'] = self.data['consumption'].astype(np.float32)
+            if 'temperature' in self.data:
+                # converted once per region, so its cache entries are shared
+                self.data['temperature'] = temperature_cache.astype(
+                    self.data['temperature'], np.float32, self.region)
+        elif precision != 'float64':
+            raise ValueError(f'precision {precision} not supported')
         self.granularity = (data[main].index[1] -
                             data[main].index[0]).total_seconds()/60.0
 
         self.features = {}
-        self.features_min_granularity = {}
-        self.features_need_data = {}
-        self.features_need_features = {}
-
-        methods_available = [m for m in dir(
-            self) if callable(getattr(self, m))]
-        self.features_defined = [
-            m for m in methods_available if not m.startswith('_')]
+        # evaluations of iterative fits and the end of the current feature's time
+        # budget (time.perf_counter()), set by _extract
+        self.max_iterations = None
+        self.deadline = None
+        # {feature: {'prior', 'start', 'evaluations'}} of iterative fits
+        self.fits = {}
 
         if 'id' in self.data:
             self.features['id'] = self.data['id']
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._register_features()
+
+    @classmethod
+    def _register_features(cls):
+        """ collect features (public methods) and the requirements recorded by their
+        decorators, once per class instead of on every instantiation. """
+        cls.features_defined = []
+        cls.features_min_granularity = {}
+        cls.features_need_data = {}
+        cls.features_need_features = {}
+        for name in dir(cls):
+            method = getattr(cls, name)
+            if not callable(method):
+                continue
+            if not name.startswith('_'):
+                cls.features_defined.append(name)
+            if hasattr(method, 'min_granularity'):
+                cls.features_min_granularity[name] = method.min_granularity
+            if hasattr(method, 'need_data'):
+                cls.features_need_data[name] = method.need_data
+            if hasattr(method, 'need_features'):
+                cls.features_need_features[name] = method.need_features
+
     # feature extraction
 
-    def _extract_available(self):
-        all = [m for m in dir(self) if (
-            callable(getattr(self, m)) and not m.startswith('_'))]
-        unavailable = []
-        for m in all:
-            try:
-                getattr(self, m)()
-            except Exception as e:
-                unavailable.append({m: e})
-        self.unavailable = unavailable
+    def _extract_available(self, details=True):
+        self._extract(self.features_defined, details)
+
+    def _extract(self, features, details=True, feature_budget=None,
+                 household_budget=None, max_iterations=None):
+        """ extract features. unavailable ones are stored as {feature: Reason} in
+        self.unavailable and, if details, their messages in self.unavailable_details.
+        feature_budget (seconds for one feature and the features it needs),
+        household_budget (seconds for all of them) and max_iterations (function
+        evaluations of iterative fits) bound the run time, features over budget are
+        unavailable with Reason.TIMEOUT, also the features they need that ran out of
+        budget while they were computed. """
+        self.unavailable = {}
+        self.unavailable_details = {}
+        self.max_iterations = max_iterations
+        deadline = (None if household_budget is None
+                    else time.perf_counter() + household_budget)
+        timer = _Timer(feature_budget is not None or household_budget is not None)
+        with timer:
+            for feature in features:
+                if feature not in self.features_defined:
+                    self.unavailable[feature] = Reason.NOT_IMPLEMENTED
+                    if details:
+                        self.unavailable_details[feature] = f'{feature} not implemented'
+                    continue
+                if self.unavailable.get(feature) == Reason.TIMEOUT:
+                    # timed out as a dependency, do not spend another budget on it
+                    if details:
+                        self.unavailable_details.setdefault(
+                            feature, f'{feature}: over budget as a dependency')
+                    continue
+                budget = feature_budget
+                if deadline is not None:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        if feature not in self.features:
+                            self._timeout(feature, details, 'household budget exhausted')
+                        continue
+                    budget = remaining if budget is None else min(budget, remaining)
+                try:
+                    self.deadline = None if budget is None else time.perf_counter() + budget
+                    timer.start(budget)
+                    getattr(self, feature)()
+                    timer.stop()
+                except _Timeout:
+                    timer.stop()
+                    if feature not in self.features:
+                        self._timeout(feature, details, f'over {budget:.3g} s budget')
+                except Exception as e:
+                    timer.stop()
+                    # keep only the reason (and message), not the exception with its traceback
+                    self.unavailable[feature] = _reason(e)
+                    if details:
+                        self.unavailable_details[feature] = str(e)
+                finally:
+                    self.deadline = None
         self.extracted = self.features
 
-    def _extract(self, features):
-        unavailable = []
-        for feature in features:
-            try:
-                getattr(self, feature)()
-            except Exception as e:
-                unavailable.append({feature: e})
+    def _check_deadline(self, feature):
+        """ for loops of iterative features: stop with Reason.TIMEOUT once the
+        current feature's time budget is spent. """
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise FeatureUnavailable(Reason.TIMEOUT, f'{feature}: over time budget')
+
+    def _timeout(self, feature, details, message):
+        self.unavailable[feature] = Reason.TIMEOUT
+        if details:
+            self.unavailable_details[feature] = f'{feature}: {message}'
+
+    def _release(self):
+        """ drop data derived during extraction (calendar, aligned, fits, pyramid, ...)
+        and the per resolution extractors. input data and features are kept. """
+        for name in [k for k in self.data if hasattr(Extractor, '_'+k)]:
+            del self.data[name]
+        self.__dict__.pop('resolution_extractors', None)
+
+    def _extract_lazy(self):
+        """ LazyFeatures that computes features only when they are read. """
+        self.extracted = LazyFeatures(self)
+        return self.extracted
+
+    def _extract_resolutions(self, resolutions, details=True):
+        """ extract each feature at its target resolution in minutes, e.g.
+        {'c_ht': 15, 'c_max': 60, 'c_weekday': 24*60, 'c_week': 7*24*60}.
+        coarser data is taken from the shared aggregate pyramid (self._pyramid),
+        features at the input resolution are computed on this extractor. """
+        by_resolution = {}
+        for feature, minutes in resolutions.items():
+            by_resolution.setdefault(minutes, []).append(feature)
+
+        extracted, unavailable, unavailable_details = {}, {}, {}
+        self.resolution_extractors = {}
+        for minutes, features in sorted(by_resolution.items()):
+            if minutes == self.granularity:
+                extractor = self
+            elif minutes in self._pyramid():
+                level = self.data['pyramid'][minutes]
+                # period config and other inputs, but no data derived at this resolution
+                data = {k: v for k, v in self.data.items()
+                        if not hasattr(Extractor, '_'+k)}
+                data.update(level)
+                extractor = Extractor(data, precision=self.precision)
+            else:
+                for feature in features:
+                    unavailable[feature] = Reason.GRANULARITY
+                    if details:
+                        unavailable_details[feature] = (
+                            f'{feature}: no data at {minutes} min resolution')
+                continue
+            self.resolution_extractors[minutes] = extractor
+            extractor._extract(features, details)
+            extracted.update({f: extractor.features[f]
+                              for f in features if f in extractor.features})
+            unavailable.update(extractor.unavailable)
+            unavailable_details.update(extractor.unavailable_details)
+        self.extracted = extracted
         self.unavailable = unavailable
-        self.extracted = self.features
+        self.unavailable_details = unavailable_details
 
     # decorators
 
@@ -76,11 +466,12 @@ class Extractor:
         def decorator_min_granularity(func):
             @functools.wraps(func)
             def wrapper(self):
-                self.features_min_granularity.update({func.__name__: min_gran})
                 if self.granularity > min_gran:
-                    raise Exception(
+                    raise FeatureUnavailable(
+                        Reason.GRANULARITY,
                         f'{func.__name__} needs granularity less than {min_gran} min')
                 return func(self)
+            wrapper.min_granularity = min_gran
             return wrapper
         return decorator_min_granularity
 
@@ -90,23 +481,24 @@ class Extractor:
         def decorator_needs_additional_data(func):
             @functools.wraps(func)
             def wrapper(self):
-                self.features_need_data.update({func.__name__: names})
                 for name in names:
                     if name in self.data:
                         globals()[name] = self.data[name]
                     elif (hasattr(self, '_'+name)
                           and callable(getattr(self, '_'+name))):
-                        logging.info(
+                        _info(
                             f'{func.__name__} needs data: {name}. generating.')
                         globals()[name] = getattr(self, '_'+name)()
                     else:
-                        raise Exception(
+                        raise FeatureUnavailable(
+                            Reason.MISSING_DATA,
                             f'{func.__name__} needs data: {name}. not defined.')
                 result = func(self)
                 # for name in names:
                 #     if name in globals():
                 #         globals().pop(name)
                 return result
+            wrapper.need_data = names
             return wrapper
         return decorator_needs_additional_data
 
@@ -115,27 +507,46 @@ class Extractor:
         def decorator_needs_features(func):
             @functools.wraps(func)
             def wrapper(self):
-                self.features_need_features.update({func.__name__: features})
                 for feature in features:
                     if feature in self.features:
                         globals()[feature] = self.features[feature]
+                    elif getattr(self, 'unavailable', {}).get(feature) == Reason.TIMEOUT:
+                        # do not spend another budget on it
+                        raise FeatureUnavailable(
+                            Reason.TIMEOUT, f'{func.__name__} needs {feature}, which timed out')
                     elif (hasattr(self, feature)
                           and callable(getattr(self, feature))):
-                        logging.info(
+                        _info(
                             f'{func.__name__} needs {feature}. generating.')
-                        # mogoce se ulovi izjeme??
-                        getattr(self, feature)()
+                        try:
+                            getattr(self, feature)()
+                        except _Timeout:
+                            self._dependency_timeout(feature)
+                            raise FeatureUnavailable(
+                                Reason.TIMEOUT,
+                                f'{func.__name__} needs {feature}, which timed out')
+                        except FeatureUnavailable as e:
+                            if e.reason == Reason.TIMEOUT:
+                                self._dependency_timeout(feature)
+                            raise
                         globals()[feature] = self.features[feature]
                     else:
-                        raise Exception(
+                        raise FeatureUnavailable(
+                            Reason.NOT_IMPLEMENTED,
                             f'{func.__name__} needs {feature}. not defined')
                 result = func(self)
                 # for name in features:
                 #     globals().pop(name)
                 # return result
+            wrapper.need_features = features
             return wrapper
         return decorator_needs_features
 
+    def _dependency_timeout(self, feature):
+        # the budget ran out in a feature computed for another one
+        if hasattr(self, 'unavailable') and feature not in self.features:
+            self.unavailable[feature] = Reason.TIMEOUT
+
     # features decorators
 
     def _check_if_exists_and_save_feature(func):
@@ -166,23 +577,29 @@ class Extractor:
 
     # data generators
 
-    @_min_granularity(24*60)
+    # calendar data. only the calendar code (weekday*24 + hour, uint8) of every sample
+    # is kept, days, hours and masks are looked up from it on every use and not saved
+
     @_import_data(['consumption'])
     @_check_if_exists_and_save_data
+    def _calendar(self):
+        index = consumption.index
+        return (index.weekday.values*24 + index.hour.values).astype(np.uint8)
+
+    @_min_granularity(24*60)
+    @_import_data(['calendar'])
     def _days(self):
-        return consumption.index.weekday.values
+        return _CELL_DAYS[calendar]
 
     @_min_granularity(24*60)
-    @_import_data(['consumption', 'days'])
-    @_check_if_exists_and_save_data
+    @_import_data(['calendar'])
     def _weekdays(self):
-        return days < 5
+        return (_CELL_DAYS < 5)[calendar]
 
     @_min_granularity(24*60)
-    @_import_data(['consumption', 'days'])
-    @_check_if_exists_and_save_data
+    @_import_data(['calendar'])
     def _weekends(self):
-        return days >= 5
+        return (_CELL_DAYS >= 5)[calendar]
 
     @_min_granularity(24*60)
     @_check_if_exists_and_save_data
@@ -222,52 +639,115 @@ class Extractor:
         return avg_week
 
     @_min_granularity(24*60)
-    @_import_data(['consumption'])
-    @_check_if_exists_and_save_data
+    @_import_data(['calendar'])
     def _hours(self):
-        return consumption.index.hour.values
+        return _CELL_HOURS[calendar]
 
     @_min_granularity(60)
-    @_import_data(['hours', 'morning_start', 'morning_end'])
-    @_check_if_exists_and_save_data
+    @_import_data(['calendar', 'morning_start', 'morning_end'])
     def _mornings(self):
-        return (hours >= morning_start) & (hours < morning_end)
+        return _hour_mask(morning_start, morning_end)[calendar]
 
     @_min_granularity(60)
-    @_import_data(['hours', 'noon_start', 'noon_end'])
-    @_check_if_exists_and_save_data
+    @_import_data(['calendar', 'noon_start', 'noon_end'])
     def _noons(self):
-        return (hours >= noon_start) & (hours < noon_end)
+        return _hour_mask(noon_start, noon_end)[calendar]
 
     @_min_granularity(60)
-    @_import_data(['hours', 'afternoon_start', 'afternoon_end'])
-    @_check_if_exists_and_save_data
+    @_import_data(['calendar', 'afternoon_start', 'afternoon_end'])
     def _afternoons(self):
-        return (hours >= afternoon_start) & (hours < afternoon_end)
+        return _hour_mask(afternoon_start, afternoon_end)[calendar]
 
     @_min_granularity(60)
-    @_import_data(['hours', 'evening_start', 'evening_end'])
-    @_check_if_exists_and_save_data
+    @_import_data(['calendar', 'evening_start', 'evening_end'])
     def _evenings(self):
-        return (hours >= evening_start) & (hours < evening_end)
+        return _hour_mask(evening_start, evening_end)[calendar]
 
     @_min_granularity(60)
-    @_import_data(['hours', 'night_start', 'night_end'])
-    @_check_if_exists_and_save_data
+    @_import_data(['calendar', 'night_start', 'night_end'])
     def _nights(self):
-        return (hours >= night_start) & (hours < night_end)
+        return _hour_mask(night_start, night_end)[calendar]
 
     @_min_granularity(60)
-    @_import_data(['hours', 'nt_start', 'nt_end'])
-    @_check_if_exists_and_save_data
+    @_import_data(['calendar', 'nt_start', 'nt_end'])
     def _nts(self):
-        return (hours >= nt_start) & (hours < nt_end)
+        return _hour_mask(nt_start, nt_end)[calendar]
 
     @_min_granularity(60)
-    @_import_data(['hours', 'ht_start', 'ht_end'])
-    @_check_if_exists_and_save_data
+    @_import_data(['calendar', 'ht_start', 'ht_end'])
     def _hts(self):
-        return (hours >= ht_start) & (hours < ht_end)
+        return _hour_mask(ht_start, ht_end)[calendar]
+
+    @_import_data(['consumption'])
+    @_check_if_exists_and_save_data
+    def _pyramid(self):
+        """ {minutes: {'consumption', 'temperature'}} for the hourly, daily and weekly
+        resolutions coarser than the input. each level is aggregated from the previous
+        one: consumption is summed, temperature averaged (via its sums and counts). """
+        temperature = self.data.get('temperature')
+        if temperature is not None:
+            levels = temperature_cache.get(temperature, consumption.index,
+                                           self.region).levels(self.granularity)
+        pyramid = {}
+        c = consumption
+        for minutes, rule in ((60, 'h'), (24*60, 'D'), (7*24*60, 'W')):
+            if minutes <= self.granularity:
+                continue
+            c = c.resample(rule).sum()
+            level = {'consumption': c}
+            if temperature is not None:
+                level['temperature'] = levels[minutes]
+            pyramid[minutes] = level
+        return pyramid
+
+    @_import_data(['consumption'])
+    @_check_if_exists_and_save_data
+    def _runs(self):
+        """ run-length encoded consumption (runLength.Runs), None when there are less
+        than runLength.MIN_COMPRESSION readings per run and the dense features are faster. """
+        runs = runLength.encode(consumption.values)
+        return runs if runLength.compression(runs) >= runLength.MIN_COMPRESSION else None
+
+    @_import_data(['consumption', 'temperature'])
+    @_check_if_exists_and_save_data
+    def _aligned(self):
+        """ temperature on the consumption index, the mask of samples where both are
+        known and the pairs under it ('x' temperature, 'y' consumption). built once
+        and shared by all temperature dependent features, the temperature side
+        ('region') comes from temperature_cache. """
+        region = temperature_cache.get(temperature, consumption.index, self.region)
+        c = consumption.values
+        t = region.temperature
+        valid = region.known & ~np.isnan(c)
+        return {'temperature': t, 'consumption': c, 'valid': valid,
+                'x': t[valid], 'y': c[valid], 'region': region}
+
+    @_import_data(['aligned'])
+    @_check_if_exists_and_save_data
+    def _temperature_fits(self):
+        """ consumption vs temperature fits for all samples and, when the period
+        config is given at hourly or finer granularity, for nights, daytime and
+        evenings. one alignment and one pass of sufficient statistics. """
+        groups = {'all': np.ones(len(aligned['valid']), dtype=bool)}
+        periods = ['night_start', 'night_end', 'evening_start', 'evening_end']
+        if self.granularity <= 60 and all(p in self.data for p in periods):
+            nights = self._nights()
+            groups.update(nights=nights, daytime=~nights, evenings=self._evenings())
+        masks = np.array(list(groups.values()))
+        region = aligned['region']
+        # without missing readings where temperature is known, the temperature
+        # side of the fits is the same for all meters of the region
+        complete = len(aligned['y']) == np.count_nonzero(region.known)
+        k, n = line_fits(aligned['temperature'], aligned['consumption'], masks,
+                         region.sums(masks) if complete else None)
+        return {name: (k[i], n[i]) for i, name in enumerate(groups)}
+
+    @_min_granularity(24*60)
+    @_import_data(['consumption', 'temperature'])
+    @_check_if_exists_and_save_data
+    def _daily_temperature_fits(self):
+        region = temperature_cache.get(temperature, consumption.index, self.region)
+        return fit_daily_temperature(temperature, consumption, region.daily_minima)
 
     # feature generators
 
@@ -276,110 +756,110 @@ class Extractor:
     @_check_if_exists_and_save_feature
     def c_week(self):
         """ average consumption throughout the week """
-        return consumption.resample('W').sum().mean()
+        return masked_mean(consumption.resample('W').sum())
 
     @_min_granularity(60)
     @_import_data(['consumption', 'mornings'])
     @_check_if_exists_and_save_feature
     def c_morning(self):
         """ average morning consumption """
-        return consumption[mornings].mean()
+        return masked_mean(consumption, mornings)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'noons'])
     @_check_if_exists_and_save_feature
     def c_noon(self):
-        return consumption[noons].mean()
+        return masked_mean(consumption, noons)
 
     @_min_granularity(60)
     @_import_data(['afternoons', 'consumption'])
     @_check_if_exists_and_save_feature
     def c_afternoon(self):
-        return consumption[afternoons].mean()
+        return masked_mean(consumption, afternoons)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'evenings'])
     @_check_if_exists_and_save_feature
     def c_evening(self):
-        return consumption[evenings].mean()
+        return masked_mean(consumption, evenings)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'nights'])
     @_check_if_exists_and_save_feature
     def c_night(self):
-        return consumption[nights].mean()
+        return masked_mean(consumption, nights)
 
     @_min_granularity(24*60)
     @_import_data(['consumption', 'weekdays'])
     @_check_if_exists_and_save_feature
     def c_weekday(self):
-        return consumption[weekdays].mean()
+        return masked_mean(consumption, weekdays)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'weekdays', 'mornings'])
     @_check_if_exists_and_save_feature
     def c_wd_morning(self):
-        return consumption[weekdays & mornings].mean()
+        return masked_mean(consumption, weekdays & mornings)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'weekdays', 'noons'])
     @_check_if_exists_and_save_feature
     def c_wd_noon(self):
-        return consumption[weekdays & noons].mean()
+        return masked_mean(consumption, weekdays & noons)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'weekdays', 'afternoons'])
     @_check_if_exists_and_save_feature
     def c_wd_afternoon(self):
-        return consumption[weekdays & afternoons].mean()
+        return masked_mean(consumption, weekdays & afternoons)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'weekdays', 'evenings'])
     @_check_if_exists_and_save_feature
     def c_wd_evening(self):
-        return consumption[weekdays & evenings].mean()
+        return masked_mean(consumption, weekdays & evenings)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'weekdays', 'nights'])
     @_check_if_exists_and_save_feature
     def c_wd_night(self):
-        return consumption[weekdays & nights].mean()
+        return masked_mean(consumption, weekdays & nights)
 
     @_min_granularity(24*60)
     @_import_data(['consumption', 'weekends'])
     @_check_if_exists_and_save_feature
     def c_weekend(self):
-        return consumption[weekends].mean()
+        return masked_mean(consumption, weekends)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'weekends', 'mornings'])
     @_check_if_exists_and_save_feature
     def c_we_morning(self):
-        return consumption[weekends & mornings].mean()
+        return masked_mean(consumption, weekends & mornings)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'weekends', 'noons'])
     @_check_if_exists_and_save_feature
     def c_we_noon(self):
-        return consumption[weekends & noons].mean()
+        return masked_mean(consumption, weekends & noons)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'weekends', 'afternoons'])
     @_check_if_exists_and_save_feature
     def c_we_afternoon(self):
-        return consumption[weekends & afternoons].mean()
+        return masked_mean(consumption, weekends & afternoons)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'weekends', 'evenings'])
     @_check_if_exists_and_save_feature
     def c_we_evening(self):
-        return consumption[weekends & evenings].mean()
+        return masked_mean(consumption, weekends & evenings)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'weekends', 'nights'])
     @_check_if_exists_and_save_feature
     def c_we_night(self):
-        return consumption[weekends & nights].mean()
+        return masked_mean(consumption, weekends & nights)
 
     @_min_granularity(60)
     @_import_features(['c_min', 'c_evening'])
@@ -405,12 +885,12 @@ class Extractor:
     @_import_data(['consumption'])
     @_check_if_exists_and_save_feature
     def c_max(self):
-        return consumption.max()
+        return masked_max(consumption)
 
     @_import_data(['consumption'])
     @_check_if_exists_and_save_feature
     def c_min(self):
-        return consumption.min()
+        return masked_min(consumption)
 
     @_min_granularity(60)
     @_import_data(['consumption'])
@@ -430,37 +910,37 @@ class Extractor:
     @_import_data(['consumption', 'hts'])
     @_check_if_exists_and_save_feature
     def c_ht(self):
-        return consumption[hts].mean()
+        return masked_mean(consumption, hts)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'nts'])
     @_check_if_exists_and_save_feature
     def c_nt(self):
-        return consumption[nts].mean()
+        return masked_mean(consumption, nts)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'weekends', 'hts'])
     @_check_if_exists_and_save_feature
     def c_we_ht(self):
-        return consumption[weekends & hts].mean()
+        return masked_mean(consumption, weekends & hts)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'weekends', 'nts'])
     @_check_if_exists_and_save_feature
     def c_we_nt(self):
-        return consumption[weekends & nts].mean()
+        return masked_mean(consumption, weekends & nts)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'weekdays', 'hts'])
     @_check_if_exists_and_save_feature
     def c_wd_ht(self):
-        return consumption[weekdays & hts].mean()
+        return masked_mean(consumption, weekdays & hts)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'weekdays', 'nts'])
     @_check_if_exists_and_save_feature
     def c_wd_nt(self):
-        return consumption[weekdays & nts].mean()
+        return masked_mean(consumption, weekdays & nts)
 
     @_min_granularity(60*24*7)
     @_import_data(['consumption'])
@@ -541,14 +1021,14 @@ class Extractor:
     @_check_if_exists_and_save_feature
     def wd_var(self):
         """ weekday variance """
-        return consumption[weekdays].var()
+        return masked_var(consumption, weekdays)
 
     @_min_granularity(24*60)
     @_import_data(['consumption', 'weekends'])
     @_check_if_exists_and_save_feature
     def we_var(self):
         """ weekend variance """
-        return consumption[weekends].var()
+        return masked_var(consumption, weekends)
 
     @_min_granularity(24*60)
     @_import_data(['consumption'])
@@ -563,28 +1043,28 @@ class Extractor:
     @_check_if_exists_and_save_feature
     def wd_min(self):
         """ minimum of weekdays consumption """
-        return consumption[weekdays].min()
+        return masked_min(consumption, weekdays)
 
     @_min_granularity(24*60)
     @_import_data(['consumption', 'weekdays'])
     @_check_if_exists_and_save_feature
     def wd_max(self):
         """ maximum of weekdays consumption """
-        return consumption[weekdays].max()
+        return masked_max(consumption, weekdays)
 
     @_min_granularity(24*60)
     @_import_data(['consumption', 'weekends'])
     @_check_if_exists_and_save_feature
     def we_min(self):
         """ minimum of weekends consumption """
-        return consumption[weekends].min()
+        return masked_min(consumption, weekends)
 
     @_min_granularity(24*60)
     @_import_data(['consumption', 'weekends'])
     @_check_if_exists_and_save_feature
     def we_max(self):
         """ maximum of weekends consumption """
-        return consumption[weekends].max()
+        return masked_max(consumption, weekends)
 
     @_min_granularity(60*24)
     @_import_data(['consumption'])
@@ -593,7 +1073,8 @@ class Extractor:
     def r_min_wd_we(self):
         """ ratio of the minimum weekday/weekend day """
         if we_min == 0:
-            raise Exception('r_min_wd_we undefined, we_min equals 0.')
+            raise FeatureUnavailable(
+                Reason.NUMERIC, 'r_min_wd_we undefined, we_min equals 0.')
         return wd_min/we_min
 
     @_min_granularity(60*24)
@@ -696,28 +1177,28 @@ class Extractor:
     @_check_if_exists_and_save_feature
     def c_wd_nt(self):
         """ average consumption on weekdays during nts """
-        return consumption[weekdays & nts].mean()
+        return masked_mean(consumption, weekdays & nts)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'weekends', 'nts'])
     @_check_if_exists_and_save_feature
     def c_we_nt(self):
         """ average consumption on weekends during nts """
-        return consumption[weekends & nts].mean()
+        return masked_mean(consumption, weekends & nts)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'weekdays', 'hts'])
     @_check_if_exists_and_save_feature
     def c_wd_ht(self):
         """ average consumption on weekdays during hts """
-        return consumption[weekdays & hts].mean()
+        return masked_mean(consumption, weekdays & hts)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'weekends', 'hts'])
     @_check_if_exists_and_save_feature
     def c_we_ht(self):
         """ average consumption on weekends during hts """
-        return consumption[weekends & hts].mean()
+        return masked_mean(consumption, weekends & hts)
 
     @_min_granularity(60)
     @_import_data(['consumption'])
@@ -764,14 +1245,14 @@ class Extractor:
     @_check_if_exists_and_save_feature
     def c_ht_max(self):
         """ maximum of ht consumption """
-        return consumption[hts].max()
+        return masked_max(consumption, hts)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'nts'])
     @_check_if_exists_and_save_feature
     def c_nt_max(self):
         """ maximum of nt consumption """
-        return consumption[nts].max()
+        return masked_max(consumption, nts)
 
     @_min_granularity(60)
     @_import_data(['consumption'])
@@ -794,14 +1275,14 @@ class Extractor:
     @_check_if_exists_and_save_feature
     def c_nt_min(self):
         """ minimum of nt consumption """
-        return consumption[nts].min()
+        return masked_min(consumption, nts)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'hts'])
     @_check_if_exists_and_save_feature
     def c_ht_min(self):
         """ minimum of nt consumption """
-        return consumption[hts].min()
+        return masked_min(consumption, hts)
 
     @_min_granularity(60)
     @_import_data(['consumption'])
@@ -824,85 +1305,94 @@ class Extractor:
     @_check_if_exists_and_save_feature
     def s_max(self):
         """ maximum in the week """
-        return average_week.max()
+        return masked_max(average_week)
 
     @_min_granularity(24*60)
     @_import_data(['consumption', 'average_week'])
     @_check_if_exists_and_save_feature
     def s_min(self):
         """ minimum in the average week """
-        return average_week.min()
+        return masked_min(average_week)
 
     @_min_granularity(24*60)
     @_import_data(['consumption', 'average_week', 'samples_in_week', 'weekdays'])
     @_check_if_exists_and_save_feature
     def s_wd_min(self):
         """ minimum in the average week, limited to weekdays (Mon—Fri) """
-        return average_week[weekdays[:samples_in_week]].min()
+        return masked_min(average_week, weekdays[:samples_in_week])
 
     @_min_granularity(24*60)
     @_import_data(['consumption', 'average_week', 'samples_in_week', 'weekdays'])
     @_check_if_exists_and_save_feature
     def s_wd_max(self):
         """ maximum in the average week, limited to weekdays (Mon—Fri) """
-        return average_week[weekdays[:samples_in_week]].max()
+        return masked_max(average_week, weekdays[:samples_in_week])
 
     @_min_granularity(24*60)
     @_import_data(['consumption', 'average_week', 'samples_in_week', 'weekends'])
     @_check_if_exists_and_save_feature
     def s_we_min(self):
         """ minimum in the average week, limited to weekends """
-        return average_week[weekends[:samples_in_week]].min()
+        return masked_min(average_week, weekends[:samples_in_week])
 
     @_min_granularity(24*60)
     @_import_data(['consumption', 'average_week', 'samples_in_week', 'weekends'])
     @_check_if_exists_and_save_feature
     def s_we_max(self):
         """ maximum in the average week, limited to weekends """
-        return average_week[weekends[:samples_in_week]].max()
+        return masked_max(average_week, weekends[:samples_in_week])
 
-    @_import_data(['consumption'])
+    @_import_data(['consumption', 'runs'])
     @_check_if_exists_and_save_feature
     def s_sm_variety(self):
         """ 20%-quintile of the deviation from the previous measured value """
+        if runs is not None:
+            return runLength.diff_quantile(runs, 0.2)
         return consumption.diff().abs().quantile(0.2)
 
-    @_import_data(['consumption'])
+    @_import_data(['consumption', 'runs'])
     @_check_if_exists_and_save_feature
     def s_bg_variety(self):
         """ 60%-quintile of the deviation from the previous measured value """
+        if runs is not None:
+            return runLength.diff_quantile(runs, 0.6)
         return consumption.diff().abs().quantile(0.6)
 
     @_import_data(['consumption'])
     @_check_if_exists_and_save_feature
     def s_variance(self):
         """ consumption variance """
-        return consumption.var()
+        return masked_var(consumption)
 
     @_min_granularity(24*60)
     @_import_data(['consumption', 'weekdays'])
     @_check_if_exists_and_save_feature
     def s_var_wd(self):
         """ variance on weekdays """
-        return consumption[weekdays].var()
+        return masked_var(consumption, weekdays)
 
     @_min_granularity(24*60)
     @_import_data(['consumption', 'weekends'])
     @_check_if_exists_and_save_feature
     def s_var_we(self):
         """ variance on weekends """
-        return consumption[weekends].var()
+        return masked_var(consumption, weekends)
 
-    @_import_data(['consumption'])
+    @_import_data(['consumption', 'runs'])
     @_check_if_exists_and_save_feature
     def s_diff(self):
         """ total of differences from predecessor (absolute value) """
+        if runs is not None:
+            return runLength.diff_sum(runs)
         return consumption.diff().abs().sum()
 
-    @_import_data(['consumption', 'neighborhood_width'])
+    @_import_data(['consumption', 'neighborhood_width', 'runs'])
     @_check_if_exists_and_save_feature
     def s_num_peaks(self):
         """ number of peak (local maximum when considering width_neighborhood measured values """
+        if runs is not None:
+            return runLength.peak_count(runs, neighborhood_width)
+        from scipy.signal import argrelextrema
         peaks = argrelextrema(consumption.values,
                               np.greater_equal, order=neighborhood_width)[0]
         return len(peaks)
@@ -930,26 +1420,28 @@ class Extractor:
     @_check_if_exists_and_save_feature
     def c_max_avg(self):
         """ average daily maximum """
-        return consumption.resample('D').max().mean()
+        return masked_mean(consumption.resample('D').max())
 
     @_min_granularity(24*60)
     @_import_data(['consumption'])
     @_check_if_exists_and_save_feature
     def c_min_avg(self):
         """ average daily minimum """
-        return consumption.resample('D').min().mean()
+        return masked_mean(consumption.resample('D').min())
 
-    @_import_data(['consumption'])
+    @_import_data(['consumption', 'runs'])
     @_check_if_exists_and_save_feature
     def s_number_zeros(self):
         """ number of zero values """
-        zeros = consumption[consumption == 0]
-        return len(zeros)
+        if runs is not None:
+            return runLength.count(runs, runs.values == 0)
+        return masked_count(consumption, consumption.values == 0)
 
     @_import_data(['consumption', 'neighborhood_width'])
     @_check_if_exists_and_save_feature
     def c_sm_max(self):
         """ maximum with simple smoothing """
+        from scipy.ndimage import uniform_filter1d
         consumption_smooth = uniform_filter1d(consumption, neighborhood_width)
         return consumption_smooth.max()
 
@@ -958,54 +1450,55 @@ class Extractor:
     @_check_if_exists_and_save_feature
     def s_nt_variance(self):
         """ variance of nt consumption """
-        return consumption[nts].var()
+        return masked_var(consumption, nts)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'hts'])
     @_check_if_exists_and_save_feature
     def s_ht_variance(self):
         """ variance of ht consumption """
-        return consumption[hts].var()
+        return masked_var(consumption, hts)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'nts', 'weekdays'])
     @_check_if_exists_and_save_feature
     def s_nt_var_wd(self):
         """ variance of nt consumption on weekdays """
-        return consumption[nts & weekdays].var()
+        return masked_var(consumption, nts & weekdays)
 
     @_min_granularity(60)
     @_import_data(['consumption', 'hts', 'weekdays'])
     @_check_if_exists_and_save_feature
     def s_ht_var_wd(self):
         """ variance of ht consumption on weekdays """
-        return consumption[hts & weekdays].var()
+        return masked_var(consumption, hts & weekdays)
 
     @_min_granularity(24*60)
     @_import_data(['consumption', 'average_week'])
     @_check_if_exists_and_save_feature
     def t_above_mean(self):
         """ number of data points above mean of the week (for the entire week) """
-        return len(average_week[average_week > average_week.mean()])
+        return len(average_week[average_week > masked_mean(average_week)])
 
     @_min_granularity(24*60)
     @_import_data(['consumption', 'average_week', 'samples_in_day'])
     @_check_if_exists_and_save_feature
     def t_daily_max(self):
         """ time of the first day’s maximum reached (averaged over all weekdays) """
-        return np.argmax(average_week[:samples_in_day])
+        return masked_argmax(average_week[:samples_in_day])
 
     @_min_granularity(24*60)
     @_import_data(['consumption', 'average_week', 'samples_in_day'])
     @_check_if_exists_and_save_feature
     def t_daily_min(self):
         """ time of the first day’s minimum reached (averaged over all weekdays) """
-        return np.argmin(average_week[:samples_in_day])
+        return masked_argmin(average_week[:samples_in_day])
 
     @_import_data(['consumption'])
     @_check_if_exists_and_save_feature
     def t_width_peaks(self):
         """ average extent of the peak """
+        from scipy.signal import find_peaks, peak_widths
         peaks, _ = find_peaks(consumption)
         p_widths, x, _, _ = peak_widths(consumption, peaks)
         return p_widths.sum()/len(p_widths)
@@ -1018,12 +1511,14 @@ class Extractor:
         return consumption.resample('D').min().median()
 
     @_min_granularity(24*60)
-    @_import_data(['consumption'])
+    @_import_data(['consumption', 'runs'])
     @_import_features(['c_base_guess'])
     @_check_if_exists_and_save_feature
     def t_const_time(self):
         """ estimated time of base load """
-        return len(consumption[consumption <= c_base_guess])
+        if runs is not None:
+            return runLength.count(runs, runs.values <= c_base_guess)
+        return masked_count(consumption, consumption.values <= c_base_guess)
 
     @_min_granularity(24*60)
     @_import_data(['consumption'])
@@ -1034,13 +1529,15 @@ class Extractor:
         return np.where(consumption.values > c_base_guess)[0][0]
 
     @_min_granularity(24*60)
-    @_import_data(['consumption'])
+    @_import_data(['consumption', 'runs'])
     @_import_features(['c_base_guess'])
     @_check_if_exists_and_save_feature
     def t_above_base(self):
         """ number of measuring points above the base load limit """
         base = self.features['c_base_guess']
-        return len(consumption[consumption > base])
+        if runs is not None:
+            return runLength.count(runs, runs.values > base)
+        return masked_count(consumption, consumption.values > base)
 
     @_min_granularity(24*60)
     @_import_data(['consumption'])
@@ -1056,69 +1553,86 @@ class Extractor:
     @_check_if_exists_and_save_feature
     def t_value_above_base(self):
         """ sum of the measuring points above the base load limit """
-        return consumption[consumption > c_base_guess].sum()
+        return masked_sum(consumption, consumption.values > c_base_guess)
 
     @_min_granularity(60)
-    @_import_data(['consumption', 'nights', 'temperature'])
+    @_import_data(['temperature_fits'])
     @_check_if_exists_and_save_feature
     def w_temp_cor_nighttime(self):
         """ linear relationship between temperature and consumption in the night """
-        x = temperature[nights]
-        y = consumption[nights]
-        x, y = dropna_and_index_intersect(x, y)
-        (k, _), _ = curve_fit(line, x, y)
+        k, _ = _slope(temperature_fits, 'nights', 'w_temp_cor_nighttime')
         return k
 
     @_min_granularity(60)
-    @_import_data(['consumption', 'nights', 'temperature'])
+    @_import_data(['temperature_fits'])
     @_check_if_exists_and_save_feature
     def w_temp_cor_daytime(self):
         """ lin relationship between temperature and consumption during day during weekdays  """
-        x = temperature[~nights]
-        y = consumption[~nights]
-        x, y = dropna_and_index_intersect(x, y)
-        (k, _), _ = curve_fit(line, x, y)
+        k, _ = _slope(temperature_fits, 'daytime', 'w_temp_cor_daytime')
         return k
 
     @_min_granularity(60)
-    @_import_data(['consumption', 'evenings', 'temperature'])
+    @_import_data(['temperature_fits'])
     @_check_if_exists_and_save_feature
     def w_temp_cor_evening(self):
         """ linear relationship between temperature and consumption in the evening """
-        x = temperature[evenings]
-        y = consumption[evenings]
-        x, y = dropna_and_index_intersect(x, y)
-        (k, _), _ = curve_fit(line, x, y)
+        k, _ = _slope(temperature_fits, 'evenings', 'w_temp_cor_evening')
         return k
 
     @_min_granularity(24*60)
-    @_import_data(['consumption', 'temperature'])
+    @_import_data(['daily_temperature_fits'])
     @_check_if_exists_and_save_feature
     def w_temp_cor_minima(self):
         """ linear relationship between the daily minima of temperature and power consumption """
-        x = temperature.resample('D').min()
-        y = consumption.resample('D').min()
-        x, y = dropna_and_index_intersect(x, y)
-        (k, _), _ = curve_fit(line, x, y)
+        k, _ = _slope(daily_temperature_fits, 'minima', 'w_temp_cor_minima')
         return k
 
     @_min_granularity(24*60)
-    @_import_data(['consumption', 'temperature'])
+    @_import_data(['daily_temperature_fits'])
     @_check_if_exists_and_save_feature
     def w_temp_cor_maxmin(self):
         """ lin relationship between the daily maxima of consumption and minima of temperature """
-        x = temperature.resample('D').min()
-        y = consumption.resample('D').max()
-        x, y = dropna_and_index_intersect(x, y)
-        (k, _), _ = curve_fit(line, x, y)
+        k, _ = _slope(daily_temperature_fits, 'maxmin', 'w_temp_cor_maxmin')
         return k
 
-    @_import_data(['consumption', 'temperature'])
+    @_import_data(['aligned'])
     @_check_if_exists_and_save_feature
     def k1(self):
         # not ideaomatic so we dont have to run the same curve_fit four times
-        x, y = dropna_and_index_intersect(temperature, consumption)
-        (k1, n1, k2, n2), _ = curve_fit(hockeyStick, x, y)
+        from scipy.optimize import curve_fit
+        x, y = aligned['x'], aligned['y']
+        limits = {} if self.max_iterations is None else {'maxfev': self.max_iterations}
+        # start from the parameters of an earlier run, if there are any, and
+        # from the default guess when that fit does not converge
+        prior = self.data.get('priors') or {}
+        p0 = [prior.get(p, np.nan) for p in HOCKEY_STICK]
+        starts = ['prior', 'default'] if np.isfinite(p0).all() and p0[0] != p0[2] else ['default']
+        evaluations = 0
+
+        def model(X, k1, n1, k2, n2):
+            self._check_deadline('k1')
+            return hockeyStick(X, k1, n1, k2, n2)
+        for start in starts:
+            try:
+                (k1, n1, k2, n2), _, info, _, _ = curve_fit(
+                    model, x, y, p0=p0 if start == 'prior' else None,
+                    full_output=True, **limits)
+            except RuntimeError as e:
+                # curve_fit only fails when it runs out of evaluations (maxfev)
+                evaluations += self.max_iterations or 200*(len(HOCKEY_STICK) + 1)
+                if start != 'default':
+                    continue
+                self.fits['k1'] = {'prior': len(starts) > 1, 'start': None,
+                                   'evaluations': evaluations}
+                if limits and 'maxfev' in str(e):
+                    raise FeatureUnavailable(
+                        Reason.TIMEOUT, f'k1: no fit in {self.max_iterations} evaluations')
+                raise
+            evaluations += info['nfev']
+            if start == 'default' or np.isfinite([k1, n1, k2, n2]).all():
+                break
+        self.fits['k1'] = {'prior': len(starts) > 1, 'start': start,
+                           'evaluations': evaluations}
         lowpoint = (n2-n1)/(k1-k2)
         consumptionAtLowpoint = hockeyStick([lowpoint], k1, n1, k2, n2)[0]
         self.features['n1'] = n1
@@ -1164,12 +1678,10 @@ class Extractor:
         return consumptionAtLowpoint
 
     @_import_features(['k1', 'n1', 'k2', 'n2'])
-    @_import_data(['consumption', 'temperature'])
+    @_import_data(['aligned'])
     @_check_if_exists_and_save_feature
     def hockeyStickErrRel(self):
-        x, y = dropna_and_index_intersect(temperature, consumption)
-        x = x.values
-        y = y.values
+        x, y = aligned['x'], aligned['y']
         yPred = hockeyStick(x, k1, n1, k2, n2)
         return np.sum(abs((yPred - y)/yPred))/len(y)
 
@@ -1178,16 +1690,13 @@ class Extractor:
     @_check_if_exists_and_save_feature
     def hockeyStickThermalEfficiency(self):
         c = consumption.dropna().values
-        return (consumptionAtLowpoint*len(c))/np.sum(c)
+        return (consumptionAtLowpoint*len(c))/np.sum(c, dtype=np.float64)
 
-    @_import_data(['consumption', 'temperature'])
+    @_import_data(['temperature_fits'])
     @_check_if_exists_and_save_feature
     def k(self):
-        # non idiomatic so we dont call curve_fit 2 times on same data
-        x, y = dropna_and_index_intersect(temperature, consumption)
-        x = x.values
-        y = y.values
-        (k, n), _ = curve_fit(line, x, y)
+        # non idiomatic so we dont fit 2 times on same data
+        k, n = _slope(temperature_fits, 'all', 'k')
         self.features['n'] = n
         return k
 
@@ -1198,12 +1707,10 @@ class Extractor:
         return n
 
     @_import_features(['k', 'n'])
-    @_import_data(['consumption', 'temperature'])
+    @_import_data(['aligned'])
     @_check_if_exists_and_save_feature
     def linearErrRel(self):
-        x, y = dropna_and_index_intersect(temperature, consumption)
-        x = x.values
-        y = y.values
+        x, y = aligned['x'], aligned['y']
         yPred = line(x, k, n)
         return np.sum(abs((yPred - y)/yPred))/len(y)
 
@@ -1213,10 +1720,11 @@ class Extractor:
         return 1 - hockeyStickErrRel/linearErrRel
 
     @_min_granularity(60)
-    @_import_data(['consumption', 'temperature', 'samples_in_day'])
+    @_import_data(['aligned', 'samples_in_day'])
     @_check_if_exists_and_save_feature
     def consumption_temperature_lag(self):
-        t, c = dropna_and_index_intersect(temperature, consumption)
+        from scipy.signal import correlate
+        t, c = aligned['x'], aligned['y']
         lags = []
         n_days = int(len(c)/samples_in_day)
         for n in range(n_days):
@@ -1264,4 +1772,7 @@ class Extractor:
     @_check_if_exists_and_save_feature
     def c_ht_var(self):
         """ variance of consumption during hts. """
-        return ((consumption[hts] - c_ht)**2).sum()/len(consumption[hts])
+        return masked_sqdev(consumption, c_ht, hts)/np.count_nonzero(hts)
+
+
+Extractor._register_features()
@@ -0,0 +1,280 @@
+""" asyncio service for on-demand feature extraction.
+
+    POST /extract   {"ids": ["2000169"], "features": ["c_ht", "k"]}
+    GET  /features
+
+concurrent requests are collected for `batch_window` seconds (or until
+`max_batch` meters are waiting) and extracted together as one batch on a
+process pool, meters on one time grid together by a FleetExtractor. results
+are cached per (meter id, feature set), except ones with features unavailable
+for missing data or a timeout.
+
+    python featureService.py --meters data/meters --periods data/periods.json \
+        --temperature data/temperature.csv --port 8080
+"""
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import math
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from featureExtractor import Extractor
+from fleetExtractor import FleetExtractor
+
+
+_temperatures = {}
+
+# results with these may change later (new readings, a less loaded worker),
+# they are not cached
+_RETRY = {'missing_data', 'timeout'}
+
+
+def read_series(path):
+    """ read a single column csv (like data/consumption.csv) as a Series. """
+    return pd.read_csv(path, parse_dates=True, index_col=0).squeeze('columns')
+
+
+class CsvMeterLoader:
+    """ loads meter data from '<directory>/<meter id>.csv' files with the layout of
+    data/consumption.csv. temperature is one shared file, read once per process. """
+
+    def __init__(self, directory, periods, temperature=None):
+        self.directory = directory
+        self.periods = periods
+        self.temperature = temperature
+
+    def __call__(self, meter_id):
+        data = dict(self.periods)
+        data['id'] = meter_id
+        data['consumption'] = read_series(
+            os.path.join(self.directory, f'{meter_id}.csv'))
+        if self.temperature is not None:
+            if self.temperature not in _temperatures:
+                _temperatures[self.temperature] = read_series(self.temperature)
+            data['temperature'] = _temperatures[self.temperature]
+        return data
+
+
+def _to_json(value):
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+def _config(data):
+    """ the config of a meter's data: everything but the id and the series. """
+    return {k: v for k, v in data.items()
+            if k != 'id' and not isinstance(v, (pd.Series, pd.DataFrame))}
+
+
+def extract_batch(loader, jobs):
+    """ extract {meter_id: features} in one worker. meters on one time grid with
+    one config are extracted together by a FleetExtractor.
+    returns {meter_id: {'features': {...}, 'unavailable': {...}}}. """
+    results = {}
+    groups = []
+    for meter_id, features in jobs.items():
+        try:
+            data = loader(meter_id)
+        except Exception:
+            logging.exception(f'no data for {meter_id}')
+            results[meter_id] = {'features': {},
+                                 'unavailable': {f: 'missing_data' for f in features}}
+            continue
+        for group in groups:
+            first = group[0][1]
+            if (first['consumption'].index.equals(data['consumption'].index)
+                    and first.get('temperature') is data.get('temperature')
+                    and _config(first) == _config(data)):
+                group.append((meter_id, data))
+                break
+        else:
+            groups.append([(meter_id, data)])
+
+    for group in groups:
+        ids = [meter_id for meter_id, _ in group]
+        data = dict(group[0][1])
+        data['consumption'] = pd.concat([d['consumption'] for _, d in group],
+                                        axis=1, keys=ids)
+        features = sorted(set().union(*(jobs[meter_id] for meter_id in ids)))
+        fleet = FleetExtractor(data)
+        fleet._extract(features, details=False)
+        unavailable = {f: reason.name.lower() for f, reason in fleet.unavailable.items()}
+        for meter_id in ids:
+            row = fleet.extracted.loc[meter_id]
+            results[meter_id] = {
+                'features': {f: _to_json(row[f]) for f in jobs[meter_id] if f in row},
+                'unavailable': {f: unavailable[f]
+                                for f in jobs[meter_id] if f in unavailable}}
+    return results
+
+
+class FeatureService:
+    def __init__(self, loader, workers=None, batch_window=0.01, max_batch=256,
+                 cache_size=100000):
+        self.loader = loader
+        self.workers = workers or os.cpu_count()
+        self.pool = ProcessPoolExecutor(self.workers)
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.pending = {}
+        self.queue = []
+        self._timer = None
+
+    async def extract(self, meter_ids, features):
+        """ features for each meter id, as {meter_id: {'features', 'unavailable'}}. """
+        features = tuple(sorted(set(features)))
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(
+            *[self._request(loop, meter_id, features) for meter_id in meter_ids])
+        return dict(zip(meter_ids, results))
+
+    def _request(self, loop, meter_id, features):
+        key = (meter_id, features)
+        future = loop.create_future()
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            future.set_result(self.cache[key])
+            return future
+        if key in self.pending:
+            # same request already waiting or running. every caller awaits it
+            # through a shield, so one caller going away does not cancel it for the others
+            return asyncio.shield(self.pending[key])
+        self.pending[key] = future
+        self.queue.append(key)
+        if len(self.queue) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.batch_window, self._flush)
+        return asyncio.shield(future)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self.queue = self.queue, []
+        if not batch:
+            return
+
+        # one job per meter with the union of requested features
+        jobs = {}
+        for meter_id, features in batch:
+            jobs.setdefault(meter_id, set()).update(features)
+        jobs = [(m, sorted(fs)) for m, fs in jobs.items()]
+        size = math.ceil(len(jobs)/self.workers)
+        chunks = [dict(jobs[i:i+size]) for i in range(0, len(jobs), size)]
+        logging.info(f'batch of {len(batch)} requests, {len(jobs)} meters')
+
+        loop = asyncio.get_running_loop()
+        for chunk in chunks:
+            keys = [key for key in batch if key[0] in chunk]
+            done = loop.run_in_executor(
+                self.pool, extract_batch, self.loader, chunk)
+            done.add_done_callback(
+                functools.partial(self._resolve, keys))
+
+    def _resolve(self, keys, done):
+        error = None if done.cancelled() else done.exception()
+        for key in keys:
+            future = self.pending.pop(key)
+            if future.done():
+                continue
+            if done.cancelled():
+                future.cancel()
+                continue
+            if error is not None:
+                future.set_exception(error)
+                continue
+            meter_id, features = key
+            meter = done.result()[meter_id]
+            result = {
+                'features': {f: meter['features'][f]
+                             for f in features if f in meter['features']},
+                'unavailable': {f: meter['unavailable'][f]
+                                for f in features if f in meter['unavailable']}}
+            if not _RETRY.intersection(result['unavailable'].values()):
+                self.cache[key] = result
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            future.set_result(result)
+
+    # http
+
+    async def _route(self, method, path, body):
+        if method == 'GET' and path == '/features':
+            return 200, Extractor.features_defined
+        if method == 'POST' and path == '/extract':
+            request = json.loads(body or b'{}')
+            ids = [str(i) for i in request['ids']]
+            return 200, await self.extract(ids, request['features'])
+        return 404, {'error': f'{method} {path} not found'}
+
+    async def _handle(self, reader, writer):
+        try:
+            method, path, _ = (await reader.readline()).decode().split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, value = line.decode().split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            status, payload = await self._route(method, path, body)
+        except Exception as e:
+            logging.exception('request failed')
+            status, payload = 400, {'error': str(e)}
+        content = json.dumps(payload).encode()
+        writer.write((f'HTTP/1.1 {status} {_STATUS[status]}\r\n'
+                      'Content-Type: application/json\r\n'
+                      f'Content-Length: {len(content)}\r\n'
+                      'Connection: close\r\n\r\n').encode() + content)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8080, path=None):
+        """ serve on a tcp port, or on a unix socket if path is given. """
+        if path is not None:
+            server = await asyncio.start_unix_server(self._handle, path)
+        else:
+            server = await asyncio.start_server(self._handle, host, port)
+        logging.info(f'serving on {path or (host, port)}')
+        async with server:
+            await server.serve_forever()
+
+
+_STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--meters', required=True,
+                        help='directory with <meter id>.csv consumption files')
+    parser.add_argument('--periods', default='data/periods.json')
+    parser.add_argument('--temperature')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--socket', help='serve on this unix socket instead')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--batch-window', type=float, default=0.01)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with open(args.periods) as f:
+        periods = json.load(f)
+    loader = CsvMeterLoader(args.meters, periods, args.temperature)
+    service = FeatureService(loader, args.workers, args.batch_window)
+    asyncio.run(service.serve(args.host, args.port, args.socket))
+
+
+if __name__ == '__main__':
+    main()
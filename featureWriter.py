@@ -0,0 +1,122 @@
+""" columnar sink for extracted features.
+
+rows are appended per household into preallocated float64 columns (one per
+feature), an id column and a packed unavailability bitmask, and flushed in
+bulk. a path ending in '.parquet' is written with pyarrow (one row group per
+flush, unavailable values as arrow nulls), any other path is a directory of
+numpy 'part-00000.npz' files.
+
+    writer = FeatureWriter('features.parquet', features)
+    for data in households:
+        extractor = Extractor(data)
+        extractor._extract(features)
+        writer.append_extractor(extractor)
+    writer.close()
+"""
+import glob
+import importlib.util
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class FeatureWriter:
+    def __init__(self, path, features, rows=65536):
+        self.path = path
+        self.features = list(features)
+        self.columns = {f: i for i, f in enumerate(self.features)}
+        self.rows = rows
+        # feature major, so every feature is one contiguous float64 array
+        self.values = np.full((len(self.features), rows), np.nan)
+        self.ids = np.empty(rows, dtype=object)
+        self.unavailable = np.zeros(
+            (rows, (len(self.features) + 7)//8), dtype=np.uint8)
+        self.n = 0
+        self.parts = 0
+        self._parquet = None
+        if path.endswith('.parquet'):
+            # fail here, not at the first flush after rows households were extracted
+            if importlib.util.find_spec('pyarrow') is None:
+                raise ImportError(f'writing {path} needs pyarrow')
+        else:
+            os.makedirs(path, exist_ok=True)
+
+    def append(self, id, extracted):
+        """ append one household. features missing from extracted are marked unavailable. """
+        columns, values = [], []
+        for f, v in extracted.items():
+            j = self.columns.get(f)
+            if j is not None:
+                columns.append(j)
+                values.append(v)
+        available = np.zeros(len(self.features), dtype=bool)
+        available[columns] = True
+        self.values[columns, self.n] = values
+        self.unavailable[self.n] = np.packbits(~available)
+        self.ids[self.n] = id
+        self.n += 1
+        if self.n == self.rows:
+            self.flush()
+
+    def append_extractor(self, extractor):
+        self.append(extractor.data.get('id', extractor.data.get('name')),
+                    extractor.extracted)
+
+    def flush(self):
+        if self.n == 0:
+            return
+        n = self.n
+        ids = np.array([str(i) for i in self.ids[:n]])
+        if self.path.endswith('.parquet'):
+            self._write_parquet(ids, n)
+        else:
+            columns = {f: self.values[j, :n] for f, j in self.columns.items()}
+            np.savez(os.path.join(self.path, f'part-{self.parts:05d}.npz'),
+                     id=ids, features=np.array(self.features),
+                     unavailable=self.unavailable[:n], **columns)
+        self.parts += 1
+        self.values.fill(np.nan)
+        self.unavailable.fill(0)
+        self.n = 0
+
+    def _write_parquet(self, ids, n):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        missing = np.unpackbits(self.unavailable[:n], axis=1)[
+            :, :len(self.features)].astype(bool)
+        arrays = [pa.array(ids)] + [pa.array(self.values[j, :n], mask=missing[:, j])
+                                    for j in range(len(self.features))]
+        table = pa.Table.from_arrays(arrays, names=['id'] + self.features)
+        if self._parquet is None:
+            self._parquet = pq.ParquetWriter(self.path, table.schema)
+        self._parquet.write_table(table)
+
+    def close(self):
+        self.flush()
+        if self._parquet is not None:
+            self._parquet.close()
+            self._parquet = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_features(path):
+    """ read features written by FeatureWriter as DataFrame indexed by id.
+    unavailable features are NaN. """
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path).set_index('id')
+    frames = []
+    for part in sorted(glob.glob(os.path.join(path, 'part-*.npz'))):
+        with np.load(part) as f:
+            features = list(f['features'])
+            missing = np.unpackbits(f['unavailable'], axis=1)[
+                :, :len(features)].astype(bool)
+            columns = {k: np.where(missing[:, j], np.nan, f[k])
+                       for j, k in enumerate(features)}
+            frames.append(pd.DataFrame(columns, index=pd.Index(f['id'], name='id')))
+    return pd.concat(frames)
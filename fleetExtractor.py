@@ -0,0 +1,500 @@
+""" vectorized feature extraction for a batch of meters.
+
+consumption is a DataFrame (time x meters) on one time grid, temperature a
+Series shared by all meters or a DataFrame with the same columns. features
+are registered with @fleet_feature and computed on the whole batch at once.
+a feature declares the data it needs, the features it depends on and its
+minimum granularity; it receives
+
+- 'consumption' (and 'temperature') as arrays of shape (time, meters),
+- calendar data from Extractor ('hts', 'weekdays', 'samples_in_day', ...) as
+  arrays of shape (time,) or scalars,
+- other data and the period config ('ht_start', ...) as given,
+- the features it depends on as arrays of shape (meters,),
+
+and returns an array of shape (meters,). example, the fleet version of c_ht_var:
+
+    @fleet_feature(['consumption', 'hts'], ['c_ht'], min_granularity=60)
+    def c_ht_var(consumption, hts, c_ht):
+        c = consumption[hts]
+        return np.nansum((c - c_ht)**2, axis=0)/len(c)
+
+features without a fleet version are extracted with Extractor per meter.
+
+    fleet = FleetExtractor(data)
+    fleet._extract(['c_ht', 'r_nt_ht', 'k'])
+    fleet.extracted  # DataFrame, meters x features
+"""
+import functools
+import warnings
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from featureExtractor import (Extractor, FeatureUnavailable, Reason, _reason,
+                              fit_temperature, fit_daily_temperature)
+
+
+FleetFeature = namedtuple(
+    'FleetFeature', ['func', 'data', 'features', 'min_granularity'])
+
+FEATURES = {}
+
+# data generated by Extractor from the time index only
+CALENDAR = ['days', 'weekdays', 'weekends', 'hours', 'mornings', 'noons',
+            'afternoons', 'evenings', 'nights', 'nts', 'hts', 'samples_in_day',
+            'samples_in_week', 'n_days', 'n_weeks']
+
+
+def fleet_feature(data=(), features=(), min_granularity=None, name=None):
+    """ register func(**inputs) -> (meters,) array as a fleet feature. """
+    def decorator(func):
+        FEATURES[name or func.__name__] = FleetFeature(
+            func, list(data), list(features), min_granularity)
+        return func
+    return decorator
+
+
+class FleetExtractor:
+    def __init__(self, data, main='consumption'):
+        self.data = dict(data)
+        frame = data[main]
+        self.main = main
+        self.ids = list(frame.columns)
+        self.index = frame.index
+        self.granularity = (self.index[1] -
+                            self.index[0]).total_seconds()/60.0
+        # calendar data only depends on the index, so it comes from one template extractor
+        template = {k: v for k, v in data.items()
+                    if not isinstance(v, (pd.Series, pd.DataFrame))}
+        template[main] = pd.Series(np.zeros(len(self.index)), index=self.index)
+        self.calendar = Extractor(template)
+        self.cache = {}
+        self.features = {}
+
+    # feature extraction
+
+    def _extract_available(self, details=True):
+        self._extract(Extractor.features_defined, details)
+
+    def _extract(self, features, details=True):
+        """ extract features for all meters. fleet features are computed on the whole
+        batch, the rest per meter. self.extracted is a DataFrame (meters x features),
+        features unavailable for the whole batch are in self.unavailable. meters where
+        a feature is not defined get nan. """
+        self.unavailable = {}
+        self.unavailable_details = {}
+        per_meter = []
+        for feature in features:
+            if feature in FEATURES:
+                try:
+                    self._feature(feature)
+                except Exception as e:
+                    self.unavailable[feature] = _reason(e)
+                    if details:
+                        self.unavailable_details[feature] = str(e)
+            elif feature in Extractor.features_defined:
+                per_meter.append(feature)
+            else:
+                self.unavailable[feature] = Reason.NOT_IMPLEMENTED
+                if details:
+                    self.unavailable_details[feature] = f'{feature} not implemented'
+        if per_meter:
+            self._extract_per_meter(per_meter, details)
+        self.extracted = pd.DataFrame(
+            {f: self.features[f] for f in features if f in self.features},
+            index=pd.Index(self.ids, name='id'))
+
+    def _extract_per_meter(self, features, details):
+        values = {f: np.full(len(self.ids), np.nan) for f in features}
+        reasons = {}
+        for i, meter in enumerate(self.ids):
+            extractor = Extractor(self._meter_data(meter))
+            extractor._extract(features, details)
+            for f in features:
+                if f in extractor.features:
+                    values[f][i] = extractor.features[f]
+            for f, reason in extractor.unavailable.items():
+                reasons.setdefault(f, (reason, extractor.unavailable_details.get(f)))
+        for f in features:
+            if f in reasons and np.isnan(values[f]).all():
+                self.unavailable[f] = reasons[f][0]
+                if details:
+                    self.unavailable_details[f] = reasons[f][1]
+            else:
+                self.features[f] = values[f]
+
+    def _meter_data(self, meter):
+        """ data dict of a single meter, as Extractor expects it. """
+        data = {}
+        for k, v in self.data.items():
+            if isinstance(v, pd.DataFrame):
+                data[k] = v[meter]
+            else:
+                data[k] = v
+        data['id'] = meter
+        return data
+
+    def _feature(self, name):
+        if name in self.features:
+            return self.features[name]
+        spec = FEATURES[name]
+        if spec.min_granularity is not None and self.granularity > spec.min_granularity:
+            raise FeatureUnavailable(
+                Reason.GRANULARITY,
+                f'{name} needs granularity less than {spec.min_granularity} min')
+        inputs = {d: self._data(d, name) for d in spec.data}
+        inputs.update({f: self._feature(f) for f in spec.features})
+        with np.errstate(all='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            value = spec.func(**inputs)
+        value = np.broadcast_to(np.asarray(value, dtype=np.float64), len(self.ids))
+        self.features[name] = value
+        return value
+
+    def _data(self, name, needed_by):
+        if name not in self.cache:
+            if hasattr(self, '_'+name):
+                self.cache[name] = getattr(self, '_'+name)()
+            elif name in CALENDAR:
+                self.cache[name] = getattr(self.calendar, '_'+name)()
+            elif name in self.data:
+                self.cache[name] = self.data[name]
+            else:
+                raise FeatureUnavailable(
+                    Reason.MISSING_DATA, f'{needed_by} needs data: {name}. not defined.')
+        return self.cache[name]
+
+    # data generators
+
+    def _consumption(self):
+        return self.data[self.main].values.astype(np.float64)
+
+    def _temperature(self):
+        if 'temperature' not in self.data:
+            raise FeatureUnavailable(
+                Reason.MISSING_DATA, 'needs data: temperature. not defined.')
+        t = self.data['temperature'].reindex(self.index).values
+        return t.reshape(len(self.index), -1)
+
+    def _hourly(self):
+        return self.data[self.main].resample('h').sum().values
+
+    def _daily(self):
+        daily = self.data[self.main].resample('D')
+        return {'sum': daily.sum().values, 'min': daily.min().values,
+                'max': daily.max().values}
+
+    def _weekly(self):
+        return self.data[self.main].resample('W').sum().values
+
+    def _average_week(self):
+        """ average week of every meter, (samples_in_week, meters). """
+        n_weeks = self._data('n_weeks', 'average_week')
+        siw = self._data('samples_in_week', 'average_week')
+        c = np.nan_to_num(self._data('consumption', 'average_week'))
+        return c[:n_weeks*siw].reshape(n_weeks, siw, -1).mean(axis=0)
+
+    def _temperature_fits(self):
+        groups = {'all': np.ones(len(self.index), dtype=bool)}
+        periods = ('night_start', 'night_end', 'evening_start', 'evening_end')
+        if self.granularity <= 60 and all(p in self.data for p in periods):
+            nights = self._data('nights', 'temperature_fits')
+            groups.update(nights=nights, daytime=~nights,
+                          evenings=self._data('evenings', 'temperature_fits'))
+        return fit_temperature(self._temperature_series(), self.data[self.main], groups)
+
+    def _daily_temperature_fits(self):
+        return fit_daily_temperature(self._temperature_series(), self.data[self.main])
+
+    def _temperature_series(self):
+        if 'temperature' not in self.data:
+            raise FeatureUnavailable(
+                Reason.MISSING_DATA, 'needs data: temperature. not defined.')
+        return self.data['temperature']
+
+
+def _selection(consumption, masks):
+    """ rows of consumption where all masks are true. """
+    if not masks:
+        return consumption
+    mask = functools.reduce(np.logical_and, masks)
+    return consumption[mask]
+
+
+def _masked(reduce, consumption, **masks):
+    c = _selection(consumption, list(masks.values()))
+    if len(c) == 0:
+        return np.nan
+    return reduce(c, axis=0)
+
+
+def _register_masked(table, reduce):
+    for name, masks in table.items():
+        fleet_feature(['consumption'] + list(masks),
+                      min_granularity=Extractor.features_min_granularity.get(name),
+                      name=name)(functools.partial(_masked, reduce))
+
+
+def _register_combined(table, combine):
+    for name, features in table.items():
+        fleet_feature(features=features,
+                      min_granularity=Extractor.features_min_granularity.get(name),
+                      name=name)(combine)
+
+
+# consumption[masks].mean() and similar, {feature: masks}
+
+MEANS = {'c_weekday': ['weekdays'], 'c_weekend': ['weekends'],
+         'c_ht': ['hts'], 'c_nt': ['nts'],
+         'c_we_ht': ['weekends', 'hts'], 'c_we_nt': ['weekends', 'nts'],
+         'c_wd_ht': ['weekdays', 'hts'], 'c_wd_nt': ['weekdays', 'nts']}
+for period in ['morning', 'noon', 'afternoon', 'evening', 'night']:
+    MEANS[f'c_{period}'] = [f'{period}s']
+    MEANS[f'c_wd_{period}'] = ['weekdays', f'{period}s']
+    MEANS[f'c_we_{period}'] = ['weekends', f'{period}s']
+
+VARIANCES = {'s_variance': [], 'wd_var': ['weekdays'], 'we_var': ['weekends'],
+             's_var_wd': ['weekdays'], 's_var_we': ['weekends'],
+             's_nt_variance': ['nts'], 's_ht_variance': ['hts'],
+             's_nt_var_wd': ['nts', 'weekdays'], 's_ht_var_wd': ['hts', 'weekdays']}
+
+MINIMA = {'c_min': [], 'wd_min': ['weekdays'], 'we_min': ['weekends'],
+          'c_nt_min': ['nts'], 'c_ht_min': ['hts']}
+
+MAXIMA = {'c_max': [], 'wd_max': ['weekdays'], 'we_max': ['weekends'],
+          'c_nt_max': ['nts'], 'c_ht_max': ['hts']}
+
+# a/b, {feature: [a, b]}
+
+RATIOS = {'r_mean_max': ['c_week', 'c_max'], 'r_min_mean': ['c_min', 'c_week'],
+          'r_night_day': ['c_night', 'c_week'], 'r_morning_noon': ['c_morning', 'c_noon'],
+          'r_evening_noon': ['c_evening', 'c_noon'], 'r_var_wd_we': ['wd_var', 'we_var'],
+          'r_max_wd_we': ['wd_max', 'we_max'],
+          'r_evening_wd_we': ['c_wd_evening', 'c_we_evening'],
+          'r_night_wd_we': ['c_wd_night', 'c_we_night'],
+          'r_noon_wd_we': ['c_wd_noon', 'c_we_noon'],
+          'r_morning_wd_we': ['c_wd_morning', 'c_we_morning'],
+          'r_afternoon_wd_we': ['c_wd_afternoon', 'c_we_afternoon'],
+          'r_we_night_day': ['c_we_night', 'c_weekend'],
+          'r_we_morning_noon': ['c_we_morning', 'c_we_noon'],
+          'r_we_evening_noon': ['c_we_evening', 'c_we_noon'],
+          'r_wd_night_day': ['c_wd_night', 'c_weekday'],
+          'r_wd_morning_noon': ['c_wd_morning', 'c_wd_noon'],
+          'r_wd_evening_noon': ['c_wd_evening', 'c_wd_noon'],
+          'r_nt_wd_we': ['c_wd_nt', 'c_we_nt'], 'r_ht_wd_we': ['c_wd_ht', 'c_we_ht'],
+          'r_nt_ht': ['c_ht', 'c_nt'], 'r_we_nt_ht': ['c_we_ht', 'c_we_nt'],
+          'r_wd_nt_ht': ['c_wd_ht', 'c_wd_nt'], 'r_ht_mean_max': ['c_ht', 'c_ht_max'],
+          'r_nt_mean_max': ['c_nt', 'c_nt_max'], 'r_ht_min_mean': ['c_ht_min', 'c_ht'],
+          'r_nt_min_mean': ['c_nt_min', 'c_nt']}
+
+# a - c_min, {feature: [a, c_min]}
+
+NO_MIN = {f'c_{p}_no_min': [f'c_{p}', 'c_min']
+          for p in ['morning', 'noon', 'afternoon', 'evening', 'night']}
+
+# (a - c_min)/(b - c_min), {feature: [a, b, c_min]}
+
+RATIOS_NO_MIN = {'r_mean_max_no_min': ['c_week', 'c_max', 'c_min'],
+                 'r_evening_noon_no_min': ['c_evening', 'c_noon', 'c_min'],
+                 'r_morning_noon_no_min': ['c_morning', 'c_noon', 'c_min'],
+                 'r_day_night_no_min': ['c_night', 'c_week', 'c_min']}
+
+
+def _ratio(**features):
+    a, b = features.values()
+    return a/b
+
+
+def _no_min(**features):
+    a, c_min = features.values()
+    return a - c_min
+
+
+def _ratio_no_min(**features):
+    a, b, c_min = features.values()
+    return (a - c_min)/(b - c_min)
+
+
+def _fit(fits, group, i, **data):
+    return data[fits][group][i]
+
+
+_register_masked(MEANS, np.nanmean)
+_register_masked(VARIANCES, functools.partial(np.nanvar, ddof=1))
+_register_masked(MINIMA, np.nanmin)
+_register_masked(MAXIMA, np.nanmax)
+_register_combined(RATIOS, _ratio)
+_register_combined(NO_MIN, _no_min)
+_register_combined(RATIOS_NO_MIN, _ratio_no_min)
+
+# {feature: (fits, group, 0 for slope or 1 for intercept)}
+FITS = {'k': ('temperature_fits', 'all', 0), 'n': ('temperature_fits', 'all', 1),
+        'w_temp_cor_nighttime': ('temperature_fits', 'nights', 0),
+        'w_temp_cor_daytime': ('temperature_fits', 'daytime', 0),
+        'w_temp_cor_evening': ('temperature_fits', 'evenings', 0),
+        'w_temp_cor_minima': ('daily_temperature_fits', 'minima', 0),
+        'w_temp_cor_maxmin': ('daily_temperature_fits', 'maxmin', 0)}
+for name, (fits, group, i) in FITS.items():
+    fleet_feature([fits], min_granularity=Extractor.features_min_granularity.get(name),
+                  name=name)(functools.partial(_fit, fits, group, i))
+
+
+@fleet_feature(features=['wd_min', 'we_min'], min_granularity=24*60)
+def r_min_wd_we(wd_min, we_min):
+    """ ratio of the minimum weekday/weekend day, nan where we_min is 0 """
+    return np.where(we_min == 0, np.nan, wd_min/we_min)
+
+
+@fleet_feature(['consumption', 'hts'], ['c_ht'], min_granularity=60)
+def c_ht_var(consumption, hts, c_ht):
+    """ variance of consumption during hts. """
+    c = consumption[hts]
+    return np.nansum((c - c_ht)**2, axis=0)/len(c)
+
+
+@fleet_feature(['weekly'], min_granularity=60*24*7)
+def c_week(weekly):
+    return np.nanmean(weekly, axis=0)
+
+
+@fleet_feature(['hourly'], min_granularity=60)
+def asc(hourly):
+    return np.abs(hourly).sum(axis=0)
+
+
+@fleet_feature(['daily'], min_granularity=24*60)
+def c_max_avg(daily):
+    return np.nanmean(daily['max'], axis=0)
+
+
+@fleet_feature(['daily'], min_granularity=24*60)
+def c_min_avg(daily):
+    return np.nanmean(daily['min'], axis=0)
+
+
+@fleet_feature(['daily'], min_granularity=24*60)
+def c_base_guess(daily):
+    return np.nanmedian(daily['min'], axis=0)
+
+
+@fleet_feature(['daily'], min_granularity=60*24)
+def MinMax(daily):
+    return np.nanmin(daily['sum'], axis=0)/np.nanmax(daily['sum'], axis=0)
+
+
+@fleet_feature(['consumption'])
+def s_q1(consumption):
+    return np.nanquantile(consumption, 0.25, axis=0)
+
+
+@fleet_feature(['consumption'])
+def s_q2(consumption):
+    return np.nanmedian(consumption, axis=0)
+
+
+@fleet_feature(['consumption'])
+def s_q3(consumption):
+    return np.nanquantile(consumption, 0.75, axis=0)
+
+
+@fleet_feature(['consumption'])
+def s_sm_variety(consumption):
+    return np.nanquantile(np.abs(np.diff(consumption, axis=0)), 0.2, axis=0)
+
+
+@fleet_feature(['consumption'])
+def s_bg_variety(consumption):
+    return np.nanquantile(np.abs(np.diff(consumption, axis=0)), 0.6, axis=0)
+
+
+@fleet_feature(['consumption'])
+def s_diff(consumption):
+    return np.nansum(np.abs(np.diff(consumption, axis=0)), axis=0)
+
+
+@fleet_feature(['consumption'])
+def s_number_zeros(consumption):
+    return (consumption == 0).sum(axis=0)
+
+
+@fleet_feature(['consumption'])
+def skewness(consumption):
+    return pd.DataFrame(consumption).skew().values
+
+
+@fleet_feature(['consumption'])
+def kurtosis(consumption):
+    return pd.DataFrame(consumption).kurtosis().values
+
+
+@fleet_feature(['consumption'], ['c_base_guess'], min_granularity=24*60)
+def t_const_time(consumption, c_base_guess):
+    return (consumption <= c_base_guess).sum(axis=0)
+
+
+@fleet_feature(['consumption'], ['c_base_guess'], min_granularity=24*60)
+def t_above_base(consumption, c_base_guess):
+    return (consumption > c_base_guess).sum(axis=0)
+
+
+@fleet_feature(['consumption'], ['t_above_base'], min_granularity=24*60)
+def t_percent_above_base(consumption, t_above_base):
+    return t_above_base/len(consumption)
+
+
+@fleet_feature(['consumption'], ['c_base_guess'], min_granularity=24*60)
+def t_value_above_base(consumption, c_base_guess):
+    return np.where(consumption > c_base_guess, consumption, 0).sum(axis=0)
+
+
+@fleet_feature(['consumption'], ['c_base_guess'], min_granularity=24*60)
+def t_first_above_base(consumption, c_base_guess):
+    above = consumption > c_base_guess
+    return np.where(above.any(axis=0), np.argmax(above, axis=0), np.nan)
+
+
+@fleet_feature(['average_week'], min_granularity=24*60)
+def s_max(average_week):
+    return average_week.max(axis=0)
+
+
+@fleet_feature(['average_week'], min_granularity=24*60)
+def s_min(average_week):
+    return average_week.min(axis=0)
+
+
+@fleet_feature(['average_week', 'samples_in_week', 'weekdays'], min_granularity=24*60)
+def s_wd_min(average_week, samples_in_week, weekdays):
+    return average_week[weekdays[:samples_in_week]].min(axis=0)
+
+
+@fleet_feature(['average_week', 'samples_in_week', 'weekdays'], min_granularity=24*60)
+def s_wd_max(average_week, samples_in_week, weekdays):
+    return average_week[weekdays[:samples_in_week]].max(axis=0)
+
+
+@fleet_feature(['average_week', 'samples_in_week', 'weekends'], min_granularity=24*60)
+def s_we_min(average_week, samples_in_week, weekends):
+    return average_week[weekends[:samples_in_week]].min(axis=0)
+
+
+@fleet_feature(['average_week', 'samples_in_week', 'weekends'], min_granularity=24*60)
+def s_we_max(average_week, samples_in_week, weekends):
+    return average_week[weekends[:samples_in_week]].max(axis=0)
+
+
+@fleet_feature(['average_week'], min_granularity=24*60)
+def t_above_mean(average_week):
+    return (average_week > average_week.mean(axis=0)).sum(axis=0)
+
+
+@fleet_feature(['average_week', 'samples_in_day'], min_granularity=24*60)
+def t_daily_max(average_week, samples_in_day):
+    return np.argmax(average_week[:samples_in_day], axis=0)
+
+
+@fleet_feature(['average_week', 'samples_in_day'], min_granularity=24*60)
+def t_daily_min(average_week, samples_in_day):
+    return np.argmin(average_week[:samples_in_day], axis=0)
@@ -0,0 +1,107 @@
+""" masked statistics without fancy-indexed copies.
+
+every kernel takes the values x (array or Series) and an optional bool mask
+of the same length, ignores nan values and reduces with `where=` instead of
+x[mask]. sums accumulate in float64 also for float32 data. kernels that need
+a temporary (deviations from the mean) compute it in blocks of BLOCK values,
+so the extra memory does not grow with the length of x.
+
+    masked_mean(consumption, weekdays & hts)   # == consumption[weekdays & hts].mean()
+"""
+import numpy as np
+
+BLOCK = 1 << 14
+
+
+def _valid(x, mask):
+    valid = ~np.isnan(x)
+    if mask is not None:
+        valid &= mask
+    return valid
+
+
+def masked_count(x, mask=None):
+    """ number of non-nan values under mask. """
+    return np.count_nonzero(_valid(np.asarray(x), mask))
+
+
+def masked_sum(x, mask=None):
+    """ sum of non-nan values under mask, 0 if there are none. """
+    x = np.asarray(x)
+    return np.add.reduce(x, where=_valid(x, mask), dtype=np.float64)
+
+
+def masked_mean(x, mask=None):
+    """ mean of non-nan values under mask, nan if there are none. """
+    x = np.asarray(x)
+    valid = _valid(x, mask)
+    n = np.count_nonzero(valid)
+    if n == 0:
+        return np.nan
+    return np.add.reduce(x, where=valid, dtype=np.float64)/n
+
+
+def _blocked_deviations(x, valid, center):
+    """ sum of (x - center) and of (x - center)**2 over valid, in float64 blocks. """
+    s = ss = np.float64(0)
+    d = np.empty(min(BLOCK, len(x)))
+    for i in range(0, len(x), BLOCK):
+        block = valid[i:i + BLOCK]
+        b = d[:len(block)]
+        np.subtract(x[i:i + BLOCK], center, out=b, dtype=np.float64)
+        s += np.add.reduce(b, where=block)
+        np.multiply(b, b, out=b)
+        ss += np.add.reduce(b, where=block)
+    return s, ss
+
+
+def masked_sqdev(x, center, mask=None):
+    """ sum of squared deviations from center of non-nan values under mask. """
+    x = np.asarray(x)
+    return _blocked_deviations(x, _valid(x, mask), center)[1]
+
+
+def masked_var(x, mask=None, ddof=1):
+    """ variance of non-nan values under mask. two-pass in float64, with the
+    correction term of the corrected two-pass algorithm compensating the rounding
+    of the mean. nan if there are not more than ddof values. """
+    x = np.asarray(x)
+    valid = _valid(x, mask)
+    n = np.count_nonzero(valid)
+    if n <= ddof:
+        return np.nan
+    mean = np.add.reduce(x, where=valid, dtype=np.float64)/n
+    s, ss = _blocked_deviations(x, valid, mean)
+    return (ss - s*s/n)/(n - ddof)
+
+
+def masked_min(x, mask=None):
+    """ minimum of non-nan values under mask, nan if there are none. """
+    x = np.asarray(x)
+    result = np.fmin.reduce(x, where=True if mask is None else mask, initial=np.inf)
+    if result == np.inf and masked_count(x, mask) == 0:
+        return np.nan
+    return result
+
+
+def masked_max(x, mask=None):
+    """ maximum of non-nan values under mask, nan if there are none. """
+    x = np.asarray(x)
+    result = np.fmax.reduce(x, where=True if mask is None else mask, initial=-np.inf)
+    if result == -np.inf and masked_count(x, mask) == 0:
+        return np.nan
+    return result
+
+
+def masked_argmax(x, mask=None):
+    """ position (in x) of the first maximum of non-nan values under mask. """
+    x = np.asarray(x)
+    valid = _valid(x, mask)
+    return int(np.argmax(np.where(valid, x, -np.inf))) if valid.any() else np.nan
+
+
+def masked_argmin(x, mask=None):
+    """ position (in x) of the first minimum of non-nan values under mask. """
+    x = np.asarray(x)
+    valid = _valid(x, mask)
+    return int(np.argmin(np.where(valid, x, np.inf))) if valid.any() else np.nan
@@ -9,7 +9,7 @@ data['temperature'] = temperature
 
 extractor = Extractor(data)
 
-fs_implemented = [f for f in dir(extractor) if f[0] != '_']
+fs_implemented = extractor.features_defined
 print(f'Features implemented: {fs_implemented}\n')
 
 print(f'MinMax is: {extractor.MinMax.__doc__}')
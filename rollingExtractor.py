@@ -0,0 +1,197 @@
+""" features over sliding windows of whole days, in one pass over the data.
+
+the readings are aggregated once per day and cell (weekday, hour) into counts
+and power sums centred on the mean of the series. a window of `window` days is
+the running sum of its days, so moving it by a day adds the new day and removes
+the oldest one (here: differences of prefix sums). minima and maxima of the
+window come from a sliding minimum over the daily minima, quartiles from a
+sorted array of the readings in the window that is updated with the readings
+of the added and removed day. all windows are then evaluated together, with
+windows in place of meters in aggregates.cell_features. the daily minima and
+maxima of the days give c_max_avg, c_min_avg and c_base_guess (a rolling
+median), c_sm_max is the maximum of the moving average of the readings, with
+only the few readings at the edges of a window smoothed again.
+
+    rolling = rolling_features(data, window=30)
+    rolling['c_ht']     # Series indexed by the last day of each window
+"""
+import numpy as np
+import pandas as pd
+
+from aggregates import (CELLS, CellAggregate, calendar_codes, cell_features,
+                        sliding_min, sliding_max)
+from featureExtractor import Extractor
+
+QUANTILES = {'s_q1': 0.25, 's_q2': 0.5, 's_q3': 0.75}
+
+
+def _quantile(sorted_values, q):
+    """ quantile with linear interpolation, as Series.quantile. """
+    n = len(sorted_values)
+    if n == 0:
+        return np.nan
+    position = q*(n - 1)
+    lo = int(position)
+    hi = min(lo + 1, n - 1)
+    a, b, t = sorted_values[lo], sorted_values[hi], position - lo
+    # same rounding as numpy's lerp
+    return b - (b - a)*(1 - t) if t >= 0.5 else a + (b - a)*t
+
+
+def _rolling_quantiles(values, day_starts, window, ends):
+    """ {feature: (windows,)} quartiles of the readings of every window. """
+    quantiles = {f: np.full(len(ends), np.nan) for f in QUANTILES}
+    ends = {end: i for i, end in enumerate(ends)}
+    in_window = np.empty(0)
+
+    def day_values(d):
+        v = values[day_starts[d]:day_starts[d + 1]]
+        return np.sort(v[~np.isnan(v)])
+
+    for d in range(len(day_starts) - 1):
+        new = day_values(d)
+        in_window = np.insert(in_window, np.searchsorted(in_window, new), new)
+        if d >= window:
+            old = day_values(d - window)
+            # position of every removed value, also of repeated ones
+            rank = np.arange(len(old)) - np.searchsorted(old, old)
+            in_window = np.delete(in_window, np.searchsorted(in_window, old) + rank)
+        if d in ends:
+            for f, q in QUANTILES.items():
+                quantiles[f][ends[d]] = _quantile(in_window, q)
+    return quantiles
+
+
+def _rolling_c_week(day_sums, weekdays, window, ends):
+    """ mean weekly (monday to sunday) consumption of the days in every window. """
+    prefix = np.concatenate([[0], np.cumsum(day_sums)])
+    mondays = np.flatnonzero(weekdays == 0)
+    c_week = np.empty(len(ends))
+    for i, end in enumerate(ends):
+        start = end - window + 1
+        inner = mondays[(mondays > start) & (mondays <= end)]
+        starts = np.concatenate([[start], inner])
+        stops = np.concatenate([inner, [end + 1]])
+        c_week[i] = np.mean(prefix[stops] - prefix[starts])
+    return c_week
+
+
+def _rolling_daily(daily_minima, daily_maxima, window, ends):
+    """ {feature: (windows,)} c_max_avg, c_min_avg and c_base_guess of every window,
+    days without readings (nan) are left out. """
+    features = {}
+    for name, daily in (('c_max_avg', daily_maxima), ('c_min_avg', daily_minima)):
+        known = ~np.isnan(daily)
+        sums = np.concatenate([[0], np.cumsum(np.where(known, daily, 0))])
+        counts = np.concatenate([[0], np.cumsum(known)])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            features[name] = ((sums[ends + 1] - sums[ends + 1 - window])
+                              / np.where(counts[ends + 1] > counts[ends + 1 - window],
+                                         counts[ends + 1] - counts[ends + 1 - window], np.nan))
+    features['c_base_guess'] = pd.Series(daily_minima).rolling(
+        window, min_periods=1).median().values[ends]
+    return features
+
+
+def _range_max(x, lo, hi):
+    """ maximum of x[lo[i]:hi[i]] for every i (nan where empty), from a sparse
+    table of maxima of power of two lengths. """
+    table = [x]
+    while 2**len(table) <= len(x):
+        step = 2**(len(table) - 1)
+        table.append(np.fmax(table[-1][:-step], table[-1][step:]))
+    result = np.full(len(lo), np.nan)
+    nonempty = hi > lo
+    lo, hi = lo[nonempty], hi[nonempty]
+    level = np.floor(np.log2(hi - lo)).astype(int)
+    for k in np.unique(level):
+        i = level == k
+        result[np.flatnonzero(nonempty)[i]] = np.fmax(table[k][lo[i]], table[k][hi[i] - 2**k])
+    return result
+
+
+def _rolling_sm_max(values, starts, stops, width):
+    """ c_sm_max (maximum of uniform_filter1d(readings, width)) of the readings
+    starts[i]:stops[i] of every window, nan for windows with a missing reading. """
+    from scipy.ndimage import uniform_filter1d
+    # the moving average looks at readings i - before ... i + after
+    before = width//2
+    after = width - before - 1
+    known = ~np.isnan(values)
+    prefix = np.concatenate([[0], np.cumsum(np.where(known, values, 0))])
+    missing = np.concatenate([[0], np.cumsum(~known)])
+    i = np.arange(before, len(values) - after)
+    smooth = np.full(len(values), np.nan)
+    smooth[i] = (prefix[i + after + 1] - prefix[i - before])/width
+    # inner readings of every window, their moving average stays in the window
+    result = _range_max(smooth, starts + before, np.maximum(stops - after, starts + before))
+    for w, (start, stop) in enumerate(zip(starts, stops)):
+        if missing[stop] > missing[start]:
+            result[w] = np.nan
+            continue
+        # readings at the edges, the moving average reflects at the window boundary
+        if stop - start <= 2*width:
+            edges = [uniform_filter1d(values[start:stop], width)]
+        else:
+            edges = [uniform_filter1d(values[start:start + 2*width], width)[:before],
+                     uniform_filter1d(values[stop - 2*width:stop], width)[2*width - after:]]
+        result[w] = np.fmax.reduce(np.concatenate([[result[w]], *edges]))
+    return result
+
+
+def rolling_features(data, window=30, step=1, main='consumption'):
+    """ features over every window of `window` whole days, one window ending every
+    `step` days. returns a DataFrame indexed by the last day of each window. """
+    consumption = data[main]
+    index = consumption.index
+    granularity = (index[1] - index[0]).total_seconds()/60.0
+    values = consumption.values.astype(np.float64)
+    first = index[0].normalize()
+    day = np.asarray((index.normalize() - first).days)
+    n_days = day[-1] + 1
+    ends = np.arange(window - 1, n_days, step)
+    if len(ends) == 0:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name='window_end'))
+
+    # per day and cell aggregates, (days, CELLS)
+    days = CellAggregate.from_values(values, day*CELLS + calendar_codes(index),
+                                     n_days*CELLS)
+    n, rows, mean, m2, minimum, maximum = (
+        a.reshape(n_days, CELLS) for a in (days.n, days.rows, days.mean, days.m2,
+                                           days.min, days.max))
+    # power sums around one centre are additive over days
+    centre = np.nanmean(values)
+    deviation = np.where(n > 0, mean - centre, 0)
+    s1 = n*deviation
+    s2 = m2 + n*deviation*deviation
+
+    def windowed(a):
+        prefix = np.concatenate([np.zeros((1, CELLS)), np.cumsum(a, axis=0)])
+        return (prefix[ends + 1] - prefix[ends + 1 - window]).T
+
+    wn, ws1, ws2 = windowed(n), windowed(s1), windowed(s2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        wmean = np.where(wn > 0, centre + ws1/wn, 0)
+        wm2 = np.where(wn > 0, np.maximum(ws2 - ws1*ws1/wn, 0), 0)
+    aggregate = CellAggregate(
+        windowed(rows), wn, wmean, wm2,
+        sliding_min(minimum, window)[ends - window + 1].T,
+        sliding_max(maximum, window)[ends - window + 1].T)
+
+    day_weekdays = np.asarray((first + pd.to_timedelta(np.arange(n_days), 'D')).weekday)
+    extra = {'c_week': _rolling_c_week((n*mean).sum(axis=1), day_weekdays, window, ends)}
+    features = cell_features(aggregate, data, granularity, extra)
+    features.update(extra)
+    day_starts = np.searchsorted(day, np.arange(n_days + 1))
+    features.update(_rolling_quantiles(values, day_starts, window, ends))
+    with np.errstate(invalid='ignore'):
+        features.update(_rolling_daily(np.fmin.reduce(minimum, axis=1),
+                                       np.fmax.reduce(maximum, axis=1), window, ends))
+    if 'neighborhood_width' in data:
+        features['c_sm_max'] = _rolling_sm_max(
+            values, day_starts[ends + 1 - window], day_starts[ends + 1],
+            data['neighborhood_width'])
+    features = {f: v for f, v in features.items()
+                if Extractor.features_min_granularity.get(f, np.inf) >= granularity}
+    return pd.DataFrame(features, index=pd.DatetimeIndex(
+        first + pd.to_timedelta(ends, 'D'), name='window_end'))
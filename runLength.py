@@ -0,0 +1,124 @@
+""" run-length encoded consumption of mostly idle meters.
+
+vacation homes and disconnected meters have long runs of zeros or of one
+constant reading. Runs keeps every run once, as its value and length (nan
+runs too), and the features that only look at values and their neighbours
+are computed from the runs in O(runs) instead of O(readings):
+
+- s_number_zeros, t_const_time, t_above_base: lengths of runs under a condition,
+- s_diff: differences only occur between runs,
+- s_sm_variety, s_bg_variety: quantiles of the differences, the differences
+  within runs are zeros,
+- s_num_peaks: a reading is a peak if no reading within `order` is larger,
+  which only depends on the neighbouring runs.
+
+Extractor encodes consumption when there are at least MIN_COMPRESSION readings
+per run on average (data['runs']) and falls back to the dense features otherwise.
+
+    runs = encode(consumption.values)
+    diff_quantile(runs, 0.2)   # == consumption.diff().abs().quantile(0.2)
+"""
+from collections import namedtuple
+
+import numpy as np
+
+# average readings per run from which the run-length features are used
+MIN_COMPRESSION = 8
+
+
+class Runs(namedtuple('Runs', ['values', 'lengths'])):
+    """ consecutive equal readings (nan equal to nan) as values and lengths. """
+    __slots__ = ()
+
+    def decode(self):
+        return np.repeat(self.values, self.lengths)
+
+
+def encode(x):
+    """ Runs of the readings x. """
+    x = np.asarray(x)
+    if len(x) == 0:
+        return Runs(x, np.zeros(0, dtype=np.int64))
+    nan = np.isnan(x)
+    change = (x[1:] != x[:-1]) & ~(nan[1:] & nan[:-1])
+    starts = np.concatenate([[0], np.flatnonzero(change) + 1])
+    return Runs(x[starts], np.diff(np.append(starts, len(x))))
+
+
+def compression(runs):
+    """ average number of readings per run. """
+    return runs.lengths.sum()/max(len(runs.lengths), 1)
+
+
+def count(runs, mask):
+    """ number of readings in the runs under mask (a condition on runs.values). """
+    return int(runs.lengths[mask].sum())
+
+
+def _differences(runs):
+    """ number of zero differences within runs and the absolute differences
+    between neighbouring runs, both without nan. """
+    known = ~np.isnan(runs.values)
+    within = int((runs.lengths[known] - 1).sum())
+    between = np.abs(np.diff(runs.values.astype(np.float64)))
+    return within, between[~np.isnan(between)]
+
+
+def diff_sum(runs):
+    """ sum of absolute differences of neighbouring readings. """
+    return np.add.reduce(_differences(runs)[1])
+
+
+def _lerp(a, b, t):
+    # same rounding as numpy's lerp
+    return b - (b - a)*(1 - t) if t >= 0.5 else a + (b - a)*t
+
+
+def diff_quantile(runs, q):
+    """ quantile (linear interpolation) of the absolute differences of neighbouring
+    readings: the zeros within runs, then the sorted differences between them. """
+    zeros, between = _differences(runs)
+    between = np.sort(between)
+    n = zeros + len(between)
+    if n == 0:
+        return np.nan
+    position = q*(n - 1)
+    lo = int(position)
+    hi = min(lo + 1, n - 1)
+
+    def value(i):
+        return 0.0 if i < zeros else between[i - zeros]
+    return _lerp(value(lo), value(hi), position - lo)
+
+
+def _free(values, lengths, order):
+    """ for every run, the number of readings (at most order) next to it on the
+    side the arrays run to, that are known and not larger than the run. each of
+    them is in one of the next order runs. """
+    r = len(values)
+    padded_values = np.append(values, np.full(order, np.nan))
+    padded_lengths = np.append(lengths, np.zeros(order, dtype=lengths.dtype))
+    total = np.zeros(r, dtype=np.int64)
+    reaching = np.ones(r, dtype=bool)
+    for k in range(1, order + 1):
+        ok = reaching & (padded_values[k:k + r] <= values)
+        total += np.where(ok, padded_lengths[k:k + r], 0)
+        reaching = ok & (total < order)
+    return np.minimum(total, order)
+
+
+def peak_count(runs, order):
+    """ number of readings that are not smaller than any reading within order
+    positions (argrelextrema(x, np.greater_equal, order=order)). """
+    values, lengths = runs.values, runs.lengths
+    n = int(lengths.sum())
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    after = _free(values, lengths, order)
+    before = _free(values[::-1], lengths[::-1], order)[::-1]
+    # readings of a run whose window reaches past the free readings on a side
+    # are not peaks, unless the free readings reach the edge of the series
+    lo = np.where(before >= starts, starts, np.maximum(starts, starts - before + order))
+    hi = np.where(after >= n - ends, ends - 1, np.minimum(ends - 1, ends - 1 + after - order))
+    peaks = np.maximum(hi - lo + 1, 0)
+    return int(peaks[~np.isnan(values)].sum())
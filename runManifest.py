@@ -0,0 +1,305 @@
+""" run manifests and incremental recompute for batch extraction.
+
+a manifest records, for one run,
+
+- 'environment': python, numpy, pandas and scipy versions,
+- 'features': the code version of every feature, a hash of the source of the
+  feature and of everything it uses (features, data generators, module functions),
+- 'inputs': for every feature, the inputs it reads ('consumption', 'ht_start', ...),
+- 'meters': per meter the fingerprint of every input (hash of index and values of
+  series, of the value of the period config), granularity, start, end, number of
+  rows, extraction time, unavailable features and a hash of the resulting row.
+
+run() compares the manifest of the previous run with the current code and data
+and extracts only the features of a meter whose code or inputs changed, reusing
+the rest of the previous output (a csv like data/features_extracted.csv).
+
+    loader = CsvMeterLoader('data/meters', periods, 'data/temperature.csv')
+    manifest = run(loader, meter_ids, features, 'features_extracted.csv')
+"""
+import datetime
+import functools
+import hashlib
+import importlib.metadata
+import inspect
+import json
+import os
+import platform
+import time
+
+import numpy as np
+import pandas as pd
+
+from featureExtractor import Extractor
+from runLength import Runs
+
+_LOCAL = os.path.dirname(os.path.abspath(inspect.getfile(Extractor)))
+
+
+def _hash(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode())
+        h.update(b'\0')
+    return h.hexdigest()[:16]
+
+
+def input_fingerprint(value):
+    """ hash of one input: index and float64 values of a series, values and lengths
+    of runs, json of anything else. """
+    if isinstance(value, (pd.Series, pd.DataFrame)):
+        index = value.index
+        if isinstance(index, pd.DatetimeIndex):
+            index = index.asi8
+        return _hash(np.ascontiguousarray(np.asarray(index)).tobytes(),
+                     np.ascontiguousarray(value.values, dtype=np.float64).tobytes())
+    if isinstance(value, Runs):
+        return _hash(np.ascontiguousarray(value.values, dtype=np.float64).tobytes(),
+                     np.ascontiguousarray(value.lengths, dtype=np.int64).tobytes())
+    return _hash(json.dumps(value, sort_keys=True, default=str))
+
+
+def describe(data, main='consumption'):
+    """ manifest entry of one meter (without timing and results). """
+    series = data[main]
+    return {'inputs': {k: input_fingerprint(v) for k, v in sorted(data.items())
+                       if k != 'id'},
+            'granularity': (series.index[1] - series.index[0]).total_seconds()/60.0,
+            'start': str(series.index[0]), 'end': str(series.index[-1]),
+            'rows': len(series)}
+
+
+def environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pd.__version__,
+            # without importing scipy, which features import only when they need it
+            'scipy': importlib.metadata.version('scipy')}
+
+
+def _code(obj):
+    obj = inspect.unwrap(obj)
+    return getattr(obj, '__code__', None)
+
+
+@functools.lru_cache(maxsize=None)
+def _source(obj):
+    # finding the source of a class parses its whole module
+    return inspect.getsource(obj)
+
+
+def _names(code):
+    """ global and attribute names and string constants used by code (and nested code). """
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, str):
+            names.add(const)
+        elif inspect.iscode(const):
+            names |= _names(const)
+    return names
+
+
+def _is_local(obj):
+    try:
+        return os.path.dirname(os.path.abspath(inspect.getfile(obj))) == _LOCAL
+    except TypeError:
+        return False
+
+
+# inputs a generator may read from self.data without declaring them
+_DATA_NAMES = {'consumption', 'temperature'} | {
+    f'{p}_{e}' for p in ['morning', 'noon', 'afternoon', 'evening', 'night', 'ht', 'nt']
+    for e in ['start', 'end']} | {'neighborhood_width', 'priors'}
+
+
+def _local_target(value):
+    """ function or class of this repository that value is or is an instance of. """
+    if inspect.isfunction(value) or inspect.isclass(value):
+        return value if _is_local(value) else None
+    if inspect.ismodule(value) or callable(value):
+        return None
+    return type(value) if _is_local(type(value)) else None
+
+
+def dependencies(name, cls=Extractor):
+    """ (sources, inputs) of a feature or data generator ('_hts'): the source of every
+    function it reaches and the names of the data inputs it reads. functions and
+    classes of local modules are followed also through attribute access
+    (runLength.encode, temperature_cache.get), a class with its whole source. """
+    sources, inputs, seen = {}, set(), set()
+
+    def scan(code, module, data, features):
+        names = _names(code)
+        for n in names:
+            if (n.startswith('_') and not n.startswith('__')
+                    and callable(getattr(cls, n, None))):
+                data.append(n[1:])
+            elif callable(getattr(cls, n, None)) and n in cls.features_defined:
+                features.append(n)
+            elif n in module:
+                value = module[n]
+                if inspect.ismodule(value) and _is_local(value):
+                    # attributes the code reads from the module
+                    for a in names:
+                        target = _local_target(vars(value).get(a))
+                        if target is not None:
+                            visit_local(target)
+                else:
+                    target = _local_target(value)
+                    if target is not None:
+                        visit_local(target)
+            elif n in _DATA_NAMES:
+                inputs.add(n)
+
+    def visit_local(obj):
+        """ a module level function or class outside cls. """
+        if inspect.isclass(obj) and issubclass(obj, cls):
+            return
+        key = f'{obj.__module__}.{obj.__qualname__}'
+        if key in seen:
+            return
+        seen.add(key)
+        sources[key] = _source(obj)
+        functions = [obj] if inspect.isfunction(obj) else [
+            getattr(member, '__func__', getattr(member, 'fget', member))
+            for member in vars(obj).values()]
+        for function in functions:
+            code = _code(function)
+            if code is not None:
+                data, features = [], []
+                scan(code, inspect.unwrap(function).__globals__, data, features)
+                follow(data, features)
+
+    def visit(key, obj):
+        if key in seen:
+            return
+        seen.add(key)
+        code = _code(obj)
+        if code is None:
+            return
+        sources[key] = _source(inspect.unwrap(obj))
+        data = list(getattr(obj, 'need_data', []))
+        features = list(getattr(obj, 'need_features', []))
+        scan(code, inspect.unwrap(obj).__globals__, data, features)
+        follow(data, features)
+
+    def follow(data, features):
+        for d in data:
+            if callable(getattr(cls, '_'+d, None)):
+                visit('_'+d, getattr(cls, '_'+d))
+            else:
+                inputs.add(d)
+        for f in features:
+            visit(f, getattr(cls, f))
+
+    visit(name, getattr(cls, name))
+    return sources, inputs
+
+
+def feature_versions(features, cls=Extractor):
+    """ {feature: code version} and {feature: sorted inputs}. """
+    versions, inputs = {}, {}
+    for f in features:
+        if f not in cls.features_defined:
+            continue
+        sources, needs = dependencies(f, cls)
+        versions[f] = _hash(*(f'{k}\n{sources[k]}' for k in sorted(sources)))
+        inputs[f] = sorted(needs)
+    return versions, inputs
+
+
+def read_manifest(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(manifest, path):
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def stale(previous, meter, entry, versions, inputs):
+    """ features of a meter that have to be extracted again. """
+    if (previous is None or previous['environment'] != environment()
+            or meter not in previous['meters']):
+        return list(versions)
+    before = previous['meters'][meter]
+    if before['granularity'] != entry['granularity']:
+        return list(versions)
+    changed = {k for k in set(entry['inputs']) | set(before['inputs'])
+               if entry['inputs'].get(k) != before['inputs'].get(k)}
+    return [f for f, v in versions.items()
+            if previous['features'].get(f) != v or changed & set(inputs[f])]
+
+
+def _row_hash(row):
+    return _hash(json.dumps({f: None if np.isnan(v) else float(v)
+                             for f, v in sorted(row.items())}))
+
+
+def _read_output(path):
+    if not os.path.exists(path):
+        return {}
+    frame = pd.read_csv(path, index_col='id', dtype={'id': str},
+                        float_precision='round_trip')
+    return {meter: row.dropna().to_dict() for meter, row in frame.iterrows()}
+
+
+def run(loader, meter_ids, features, output, manifest=None):
+    """ extract features of meter_ids into the csv output, recomputing only what
+    changed since the run recorded in manifest (default '<output>.manifest.json').
+    loader(meter_id) returns the data dict of a meter. returns the new manifest. """
+    manifest = manifest or output + '.manifest.json'
+    previous = read_manifest(manifest)
+    old = _read_output(output) if previous is not None else {}
+    versions, inputs = feature_versions(features)
+    current = {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+               'environment': environment(), 'features': versions, 'inputs': inputs,
+               'meters': {}}
+    rows = {}
+    started = time.perf_counter()
+    for meter in meter_ids:
+        t = time.perf_counter()
+        data = loader(meter)
+        entry = describe(data)
+        todo = stale(previous, meter, entry, versions, inputs)
+        row = {f: v for f, v in old.get(meter, {}).items()
+               if f in versions and f not in todo}
+        unavailable = {f: r for f, r in
+                       previous['meters'].get(meter, {}).get('unavailable', {}).items()
+                       if f in versions and f not in todo} if previous else {}
+        if todo:
+            extractor = Extractor(data)
+            extractor._extract(todo, details=False)
+            row.update({f: float(extractor.features[f]) for f in todo
+                        if f in extractor.features})
+            unavailable.update({f: r.name for f, r in extractor.unavailable.items()})
+        entry.update(seconds=round(time.perf_counter() - t, 6), recomputed=len(todo),
+                     unavailable=unavailable, result=_row_hash(
+                         {f: row.get(f, np.nan) for f in versions}))
+        current['meters'][meter] = entry
+        rows[meter] = row
+    current['seconds'] = round(time.perf_counter() - started, 6)
+
+    frame = pd.DataFrame.from_dict(rows, orient='index').reindex(columns=list(versions))
+    frame.index.name = 'id'
+    frame.to_csv(output)
+    write_manifest(current, manifest)
+    return current
+
+
+def compare(a, b):
+    """ differences between two manifests of the same fleet: meters whose inputs,
+    granularity or results differ and features whose code version differs. """
+    differences = {'features': sorted(f for f in set(a['features']) | set(b['features'])
+                                      if a['features'].get(f) != b['features'].get(f)),
+                   'inputs': [], 'results': []}
+    for meter in sorted(set(a['meters']) & set(b['meters'])):
+        x, y = a['meters'][meter], b['meters'][meter]
+        if x['inputs'] != y['inputs'] or x['granularity'] != y['granularity']:
+            differences['inputs'].append(meter)
+        elif x['result'] != y['result']:
+            # same inputs, different output: not reproducible (or code changed)
+            differences['results'].append(meter)
+    return differences
@@ -0,0 +1,117 @@
+""" period config dependent features for many period configs, from one cell aggregate.
+
+tariff studies evaluate many variants of ht_start/ht_end, nt_start/nt_end and
+morning_start ... night_end on the same data. the features that depend on the
+config (c_ht, r_nt_ht, c_wd_morning, ...) are statistics over sets of cells
+(hours of the week), so the readings are aggregated once into an
+aggregates.CellAggregate (168 cells x meters) and every scenario only combines
+cells of that table: the cost of a scenario does not depend on the length of
+the data. values are the ones of an Extractor with the scenario's config.
+
+the temperature fits of nights, daytime and evenings (w_temp_cor_*, and k, n
+of all readings, computed with them) come the same way from per cell sums of
+temperature and consumption (shifted by their means), as line_fits sums them
+per group. linearErrRel and hockeyStickDependency read the config only through
+these fits and need the readings, they are not computed (UNSUPPORTED_FEATURES),
+their values are the same in every scenario.
+
+    scenarios = {'ht 6-22': {'ht_start': 6, 'ht_end': 22},
+                 'ht 7-21': {'ht_start': 7, 'ht_end': 21, 'nt_start': 21, 'nt_end': 24}}
+    scenario_features(data, scenarios)      # DataFrame, scenarios x features
+    scenario_features(data, [config, ...])  # scenarios 0, 1, ...
+
+a scenario is a partial config, keys it does not give are taken from data.
+with a DataFrame (time x meters) as consumption the index is (scenario, id).
+"""
+import numpy as np
+import pandas as pd
+
+from aggregates import CELLS, CellAggregate, calendar_codes, cell_features, cell_masks
+from featureExtractor import Extractor, line_from_sums
+from runManifest import dependencies
+
+PERIOD_KEYS = {f'{p}_{edge}' for p in ['morning', 'noon', 'afternoon', 'evening',
+                                       'night', 'ht', 'nt']
+               for edge in ['start', 'end']}
+
+# features of Extractor that read the period config, directly or through the
+# data generators and features they use (also ones called as self._nights())
+CONFIG_FEATURES = sorted(f for f in Extractor.features_defined
+                         if dependencies(f)[1] & PERIOD_KEYS)
+
+# need the readings, not only per cell sums
+UNSUPPORTED_FEATURES = ['hockeyStickDependency', 'linearErrRel']
+
+# temperature fit group of each feature
+TEMPERATURE_FITS = {'k': 'all', 'w_temp_cor_nighttime': 'nights',
+                    'w_temp_cor_daytime': 'daytime', 'w_temp_cor_evening': 'evenings'}
+
+
+def temperature_cells(temperature, frame, codes):
+    """ x0, y0 and per cell n, sums of x, y, xy and x^2 (each (CELLS, meters)) of
+    the temperature x and consumption y shifted by their means over the pairs
+    where both are known, as in line_fits. """
+    x = temperature.reindex(frame.index).values.astype(np.float64)
+    x, y = np.broadcast_arrays(x.reshape(len(x), -1), frame.values.astype(np.float64))
+    valid = ~np.isnan(x) & ~np.isnan(y)
+    with np.errstate(invalid='ignore'):
+        x0 = np.nanmean(np.where(valid, x, np.nan), axis=0)
+        y0 = np.nanmean(np.where(valid, y, np.nan), axis=0)
+    x = np.where(valid, x - x0, 0)
+    y = np.where(valid, y - y0, 0)
+    order = np.argsort(codes, kind='stable')
+    present, starts = np.unique(codes[order], return_index=True)
+    sums = {}
+    for name, a in (('n', valid), ('sx', x), ('sy', y), ('sxy', x*y), ('sxx', x*x)):
+        sums[name] = np.zeros((CELLS, x.shape[1]))
+        sums[name][present] = np.add.reduceat(a[order].astype(np.float64), starts, axis=0)
+    return x0, y0, sums
+
+
+def _temperature_features(cells, periods, granularity):
+    """ {feature: (meters,)} of the temperature fits for one config. """
+    x0, y0, sums = cells
+    groups = {'all': np.ones(CELLS, dtype=bool)}
+    masks = cell_masks(periods)
+    if granularity <= 60 and 'nights' in masks and 'evenings' in masks:
+        groups.update(nights=masks['nights'], daytime=~masks['nights'],
+                      evenings=masks['evenings'])
+    g = np.array(list(groups.values()), dtype=np.float64)
+    k, n = line_from_sums(x0, y0, *(g @ sums[s] for s in ('n', 'sx', 'sy', 'sxy', 'sxx')))
+    fits = {group: i for i, group in enumerate(groups)}
+    features = {f: k[fits[group]] for f, group in TEMPERATURE_FITS.items() if group in fits}
+    features['n'] = n[fits['all']]
+    return features
+
+
+def scenario_features(data, scenarios, main='consumption'):
+    """ DataFrame (scenarios x features) of the period config dependent features
+    for every scenario, scenarios a {name: config} dict or a list of configs. """
+    if not isinstance(scenarios, dict):
+        scenarios = dict(enumerate(scenarios))
+    consumption = data[main]
+    frame = consumption.to_frame() if isinstance(consumption, pd.Series) else consumption
+    index = frame.index
+    granularity = (index[1] - index[0]).total_seconds()/60.0
+    # config independent parts, once: the cell tables and c_week for the ratios
+    codes = calendar_codes(index)
+    aggregate = CellAggregate.from_values(frame.values, codes)
+    extra = {}
+    if Extractor.features_min_granularity['c_week'] >= granularity:
+        extra['c_week'] = np.nanmean(frame.resample('W').sum().values, axis=0)
+    temperature = (temperature_cells(data['temperature'], frame, codes)
+                   if 'temperature' in data else None)
+
+    rows = {}
+    for name, config in scenarios.items():
+        periods = dict(data, **config)
+        features = cell_features(aggregate, periods, granularity, extra)
+        if temperature is not None:
+            features.update(_temperature_features(temperature, periods, granularity))
+        rows[name] = {f: v for f, v in features.items() if f in CONFIG_FEATURES
+                      and Extractor.features_min_granularity.get(f, np.inf) >= granularity}
+    if isinstance(consumption, pd.Series):
+        return pd.DataFrame({name: {f: v[0] for f, v in row.items()}
+                             for name, row in rows.items()}).T.rename_axis('scenario')
+    return pd.concat({name: pd.DataFrame(row, index=pd.Index(frame.columns, name='id'))
+                      for name, row in rows.items()}, names=['scenario'])
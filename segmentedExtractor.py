@@ -0,0 +1,143 @@
+""" features per calendar month, season or custom segment, in one pass over the data.
+
+the segment is one more grouping dimension: readings are aggregated once by
+(segment, cell) into aggregates.CellAggregate (codes segment*168 + cell), and
+by (segment, day) and (segment, week) into sums, minima and maxima. all
+segments are then evaluated together, with segments in place of meters in
+aggregates.cell_features. every value is the one of an Extractor on
+consumption[segment == s], also for segments that are not contiguous.
+
+    by_month = segmented_features(data, 'month')
+    by_month.loc['2017-08', 'c_ht']
+    segmented_features(data, 'season')          # '2017-summer', '2018-winter' (dec-feb), ...
+    segmented_features(data, labels)           # Series or array of labels, nan is left out
+
+only features computable from these aggregates are returned (SEGMENTED_FEATURES),
+others need an Extractor per segment.
+"""
+import numpy as np
+import pandas as pd
+
+from aggregates import CELLS, CellAggregate, calendar_codes, cell_features
+from chunkedExtractor import CHUNKED_FEATURES, _average_week_features
+from featureExtractor import Extractor
+
+SEASONS = ['winter', 'spring', 'summer', 'autumn']
+
+QUANTILES = {'s_q1': 0.25, 's_q2': 0.5, 's_q3': 0.75}
+
+SEGMENTED_FEATURES = sorted(set(CHUNKED_FEATURES) | set(QUANTILES) | {
+    't_const_time', 't_above_base', 't_percent_above_base'})
+
+
+def segment_codes(index, by):
+    """ (segment of every timestamp, -1 where there is none, and the sorted labels). """
+    if isinstance(by, str):
+        year, month = index.year.values, index.month.values
+        if by == 'month':
+            keys = year*12 + month - 1
+        elif by == 'season':
+            # december belongs to the winter of the next year
+            keys = (year + (month == 12))*4 + (month % 12)//3
+        else:
+            raise ValueError(f'segments by {by} not supported')
+        present, codes = np.unique(keys, return_inverse=True)
+        if by == 'month':
+            labels = [f'{k//12}-{k % 12 + 1:02d}' for k in present]
+        else:
+            labels = [f'{k//4}-{SEASONS[k % 4]}' for k in present]
+        return codes.astype(np.intp), labels
+    if isinstance(by, pd.Series):
+        by = by.reindex(index)
+    codes, labels = pd.factorize(np.asarray(by), sort=True, use_na_sentinel=True)
+    return codes.astype(np.intp), list(labels)
+
+
+def _by_key(values, keys):
+    """ present keys and the sum, minimum and maximum of values per key, keys sorted. """
+    present, starts = np.unique(keys, return_index=True)
+    return (present, np.add.reduceat(np.nan_to_num(values), starts),
+            np.fmin.reduceat(values, starts), np.fmax.reduceat(values, starts))
+
+
+def segmented_features(data, by='month', main='consumption'):
+    """ DataFrame (segments x features) of the features of every segment of the
+    readings, segments by 'month', 'season' or labels of the readings. """
+    consumption = data[main]
+    index = consumption.index
+    granularity = (index[1] - index[0]).total_seconds()/60.0
+    codes, labels = segment_codes(index, by)
+    n_segments = len(labels)
+    # rows in segment order and in time order within a segment, as in a slice
+    order = np.argsort(codes, kind='stable')[np.count_nonzero(codes < 0):]
+    segment = codes[order]
+    values = consumption.values.astype(np.float64)[order]
+    times = index[order]
+    starts = np.searchsorted(segment, np.arange(n_segments + 1))
+    rows = np.diff(starts)
+
+    cells = CellAggregate.from_values(values, segment*CELLS + calendar_codes(times),
+                                      n_segments*CELLS)
+    aggregate = CellAggregate(*(a.reshape(n_segments, CELLS).T for a in (
+        cells.rows, cells.n, cells.mean, cells.m2, cells.min, cells.max)))
+
+    # days and weeks (ending on sunday, as resample('W')) since the first day
+    first = index[0].normalize()
+    day = np.asarray((times.normalize() - first).days)
+    week = (day + first.weekday())//7
+    n_days = day.max() + 1 if len(day) else 1
+    n_weeks_total = week.max() + 1 if len(week) else 1
+    days, daily_sum, daily_min, daily_max = _by_key(values, segment*n_days + day)
+    weeks, weekly_sum, _, _ = _by_key(values, segment*n_weeks_total + week)
+    day_segment, week_segment = days // n_days, weeks // n_weeks_total
+
+    features = {f: np.full(n_segments, np.nan) for f in
+                ['c_week', 'c_max_avg', 'c_min_avg', 'c_base_guess', 'MinMax', *QUANTILES]}
+    samples_in_week = int(7*24*60/granularity)
+    samples_in_day = int(24*60/granularity)
+    with np.errstate(all='ignore'):
+        for s in range(n_segments):
+            if rows[s] == 0:
+                continue
+            d = day_segment == s
+            # resample bins every day (week) from the first to the last one of the
+            # segment, a bin without readings sums to 0 and has no minimum
+            day_bins = day[starts[s + 1] - 1] - day[starts[s]] + 1
+            week_bins = week[starts[s + 1] - 1] - week[starts[s]] + 1
+            sums = daily_sum[d]
+            if len(sums) < day_bins:
+                sums = np.append(sums, 0.0)
+            features['c_week'][s] = np.add.reduce(weekly_sum[week_segment == s])/week_bins
+            features['c_max_avg'][s] = np.nanmean(daily_max[d])
+            features['c_min_avg'][s] = np.nanmean(daily_min[d])
+            features['c_base_guess'][s] = np.nanmedian(daily_min[d])
+            features['MinMax'][s] = sums.min()/sums.max()
+            block = values[starts[s]:starts[s + 1]]
+            known = np.sort(block[~np.isnan(block)])
+            if len(known):
+                for f, q in QUANTILES.items():
+                    features[f][s] = np.quantile(known, q)
+            # average week over the complete weeks from the first reading of the segment
+            n_weeks = len(block)//samples_in_week if samples_in_week else 0
+            if n_weeks:
+                average_week = np.nan_to_num(block[:n_weeks*samples_in_week]).reshape(
+                    n_weeks, samples_in_week, 1).mean(axis=0)
+                weekdays = times[starts[s]:starts[s] + samples_in_week].weekday < 5
+                for f, v in _average_week_features(
+                        average_week, samples_in_day, weekdays).items():
+                    features.setdefault(f, np.full(n_segments, np.nan))[s] = v[0]
+
+        same = segment[1:] == segment[:-1]
+        differences = np.abs(np.diff(values))[same]
+        features['s_diff'] = np.bincount(segment[1:][same], np.nan_to_num(differences),
+                                         minlength=n_segments)
+        features['s_number_zeros'] = np.bincount(segment, values == 0, minlength=n_segments)
+        base = features['c_base_guess'][segment]
+        features['t_const_time'] = np.bincount(segment, values <= base, minlength=n_segments)
+        features['t_above_base'] = np.bincount(segment, values > base, minlength=n_segments)
+        features['t_percent_above_base'] = features['t_above_base']/rows
+        features.update(cell_features(aggregate, data, granularity, features))
+
+    features = {f: v for f, v in features.items()
+                if Extractor.features_min_granularity.get(f, np.inf) >= granularity}
+    return pd.DataFrame(features, index=pd.Index(labels, name='segment'))
@@ -0,0 +1,220 @@
+""" a fleet (time x meters) matrix in shared memory, for multi-process extraction.
+
+SharedFleet places the consumption values (float64, column-major, so every
+meter is one contiguous block), the time index and the temperature once in
+multiprocessing.shared_memory, or in memory-mapped .npy files when a
+directory is given. tasks carry only the small descriptor (segment names,
+shapes and dtypes) and a range of columns; a worker attaches to the segments
+once per process and gives Extractor a Series over a read-only view of the
+meter's column, so nothing is copied or pickled per meter.
+
+    with SharedFleet(frame, temperature) as fleet:
+        shared = SharedExtractor(fleet, periods, workers=8)
+        shared._extract(['c_ht', 'r_nt_ht', 'k'])
+        shared.extracted  # DataFrame, meters x features
+
+SharedSource(fleet) reads blocks of the shared matrix for ChunkedExtractor
+(FrameSource pickles the whole frame with every block).
+"""
+import os
+import shutil
+import tempfile
+import uuid
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from featureExtractor import Extractor, Reason
+
+Segment = namedtuple('Segment', ['name', 'path', 'shape', 'dtype', 'order'])
+# times: index segment -> (unit, time zone) of the DatetimeIndex it holds
+Descriptor = namedtuple('Descriptor', ['key', 'segments', 'times'])
+
+# per process: descriptor key -> (shared memory handles, arrays)
+_attached = {}
+
+
+def _time(index):
+    return index.unit, None if index.tz is None else str(index.tz)
+
+
+def _index(i8, unit, tz):
+    index = pd.DatetimeIndex(i8.view(f'M8[{unit}]'))
+    return index if tz is None else index.tz_localize('UTC').tz_convert(tz)
+
+
+class SharedFleet:
+    """ consumption (DataFrame, time x meters) and an optional temperature Series,
+    placed once in shared memory (or in memory-mapped files under directory).
+    the creating process owns the segments: close() (or leaving the with block)
+    frees them, workers must be done by then. """
+
+    def __init__(self, consumption, temperature=None, directory=None):
+        self.ids = list(consumption.columns)
+        self.length = len(consumption)
+        self._handles = []
+        self._directory = (tempfile.mkdtemp(prefix='fleet-', dir=directory)
+                           if directory is not None else None)
+        arrays = {'values': consumption, 'index': consumption.index.asi8}
+        times = {'index': _time(consumption.index)}
+        if temperature is not None:
+            arrays['temperature'] = temperature
+            arrays['temperature_index'] = temperature.index.asi8
+            times['temperature_index'] = _time(temperature.index)
+        segments = {k: self._place(k, a) for k, a in arrays.items()}
+        self.descriptor = Descriptor(uuid.uuid4().hex, segments, times)
+
+    def _place(self, key, source):
+        values = source.values if isinstance(source, (pd.Series, pd.DataFrame)) else source
+        dtype = np.dtype(np.int64 if key.endswith('index') else np.float64)
+        order = 'F' if values.ndim == 2 else 'C'
+        if self._directory is not None:
+            path = os.path.join(self._directory, f'{key}.npy')
+            target = np.lib.format.open_memmap(path, mode='w+', dtype=dtype,
+                                               shape=values.shape,
+                                               fortran_order=order == 'F')
+            target[...] = values
+            target.flush()
+            del target
+            return Segment(None, path, values.shape, dtype.str, order)
+        shm = shared_memory.SharedMemory(create=True, size=max(values.size*dtype.itemsize, 1))
+        self._handles.append(shm)
+        np.ndarray(values.shape, dtype, buffer=shm.buf, order=order)[...] = values
+        return Segment(shm.name, None, values.shape, dtype.str, order)
+
+    def close(self):
+        _attached.pop(self.descriptor.key, None)
+        for shm in self._handles:
+            shm.close()
+            shm.unlink()
+        self._handles = []
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach(descriptor):
+    """ {segment: read-only array} of a shared fleet, attached once per process. """
+    if descriptor.key not in _attached:
+        handles, arrays = [], {}
+        for k, s in descriptor.segments.items():
+            if s.path is not None:
+                arrays[k] = np.load(s.path, mmap_mode='r')
+                continue
+            shm = shared_memory.SharedMemory(name=s.name)
+            handles.append(shm)
+            a = np.ndarray(s.shape, s.dtype, buffer=shm.buf, order=s.order)
+            a.flags.writeable = False
+            arrays[k] = a
+        for k, (unit, tz) in descriptor.times.items():
+            arrays[k] = _index(arrays[k], unit, tz)
+        if 'temperature' in arrays:
+            arrays['temperature'] = pd.Series(arrays['temperature'], copy=False,
+                                              index=arrays.pop('temperature_index'))
+        _attached[descriptor.key] = handles, arrays
+    return _attached[descriptor.key][1]
+
+
+def meter_data(descriptor, column, id, periods):
+    """ data dict of the meter in the given column, as Extractor expects it. """
+    arrays = attach(descriptor)
+    data = dict(periods)
+    data['id'] = id
+    data['consumption'] = pd.Series(arrays['values'][:, column], index=arrays['index'],
+                                    copy=False)
+    if 'temperature' in arrays:
+        data['temperature'] = arrays['temperature']
+    return data
+
+
+def extract_columns(descriptor, start, ids, periods, features, details=True, limits={}):
+    """ [(features, {feature: (reason, details)})] of the meters in columns
+    start:start + len(ids). """
+    rows = []
+    for column, id in enumerate(ids, start):
+        extractor = Extractor(meter_data(descriptor, column, id, periods))
+        extractor._extract(features, details, **limits)
+        rows.append(({f: extractor.features[f] for f in features if f in extractor.features},
+                     {f: (r, extractor.unavailable_details.get(f))
+                      for f, r in extractor.unavailable.items()}))
+    return rows
+
+
+class SharedExtractor:
+    """ Extractor for every meter of a SharedFleet on a process pool, tasks of
+    meters_per_task columns. results like FleetExtractor: self.extracted is a
+    DataFrame (meters x features), features unavailable for every meter are in
+    self.unavailable. """
+
+    def __init__(self, fleet, periods, workers=None, meters_per_task=64):
+        self.fleet = fleet
+        self.periods = {k: v for k, v in periods.items()
+                        if not isinstance(v, (pd.Series, pd.DataFrame))}
+        self.workers = workers or os.cpu_count()
+        self.meters_per_task = meters_per_task
+
+    def _extract_available(self, details=True):
+        self._extract(Extractor.features_defined, details)
+
+    def _extract(self, features, details=True, **limits):
+        """ extract features for all meters. limits are the budgets of Extractor._extract. """
+        ids = self.fleet.ids
+        starts = range(0, len(ids), self.meters_per_task)
+        values = {f: np.full(len(ids), np.nan) for f in features}
+        reasons = {}
+        with ProcessPoolExecutor(self.workers) as pool:
+            tasks = [pool.submit(extract_columns, self.fleet.descriptor, start,
+                                 ids[start:start + self.meters_per_task], self.periods,
+                                 features, details, limits)
+                     for start in starts]
+            i = 0
+            for task in tasks:
+                for extracted, unavailable in task.result():
+                    for f, v in extracted.items():
+                        values[f][i] = v
+                    for f, reason in unavailable.items():
+                        reasons.setdefault(f, reason)
+                    i += 1
+        self.unavailable = {}
+        self.unavailable_details = {}
+        for f in features:
+            if f not in Extractor.features_defined:
+                reasons.setdefault(f, (Reason.NOT_IMPLEMENTED, f'{f} not implemented'))
+            if f in reasons and np.isnan(values[f]).all():
+                self.unavailable[f] = reasons[f][0]
+                if details:
+                    self.unavailable_details[f] = reasons[f][1]
+        self.extracted = pd.DataFrame(
+            {f: values[f] for f in features if f not in self.unavailable},
+            index=pd.Index(ids, name='id'))
+
+
+class SharedSource:
+    """ blocks of a SharedFleet, for ChunkedExtractor. pickles as the descriptor
+    and the meter ids, the matrix stays in shared memory. """
+
+    def __init__(self, fleet):
+        self.descriptor = fleet.descriptor
+        self.meters = list(fleet.ids)
+        self.length = fleet.length
+        self._columns = None
+
+    def __getstate__(self):
+        return {**self.__dict__, '_columns': None}
+
+    def read(self, meters, start, stop):
+        if self._columns is None:
+            self._columns = {m: i for i, m in enumerate(self.meters)}
+        arrays = attach(self.descriptor)
+        columns = [self._columns[m] for m in meters]
+        return pd.DataFrame(arrays['values'][start:stop, columns],
+                            index=arrays['index'][start:stop], columns=meters)
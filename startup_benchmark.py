@@ -0,0 +1,62 @@
+""" import time budget of featureExtractor for short-lived workers.
+
+every measurement runs in a fresh interpreter: numpy and pandas are imported
+first (every worker needs them anyway), then featureExtractor, and only the
+second import is counted against the budget. scipy must not be imported until
+a feature that needs it (k1, s_num_peaks, c_sm_max, t_width_peaks,
+consumption_temperature_lag) is computed.
+
+    python startup_benchmark.py [--budget 0.1] [--runs 5]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+PROBE = '''
+import json, sys, time
+import numpy, pandas
+start = time.perf_counter()
+import featureExtractor
+elapsed = time.perf_counter() - start
+after_import = 'scipy' in sys.modules
+data = json.load(open('data/periods.json'))
+data['consumption'] = pandas.Series(
+    numpy.arange(4*24*14, dtype=float),
+    index=pandas.date_range('2020-01-06', periods=4*24*14, freq='15min'))
+featureExtractor.Extractor(data)._extract(['c_ht', 's_variance', 'r_nt_ht', 's_q1'])
+print(json.dumps({'seconds': elapsed, 'scipy_after_import': after_import,
+                  'scipy_after_extract': 'scipy' in sys.modules}))
+'''
+
+
+def measure():
+    result = subprocess.run([sys.executable, '-c', PROBE], capture_output=True,
+                            text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--budget', type=float, default=0.1,
+                        help='seconds for importing featureExtractor after numpy and pandas')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    seconds = statistics.median(r['seconds'] for r in runs)
+    print(f'import featureExtractor: {seconds*1000:.1f} ms (median of {args.runs}), '
+          f'budget {args.budget*1000:.0f} ms')
+    failed = seconds > args.budget
+    if any(r['scipy_after_import'] for r in runs):
+        print('scipy is imported by importing featureExtractor')
+        failed = True
+    if any(r['scipy_after_extract'] for r in runs):
+        print('scipy is imported by features that do not need it')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
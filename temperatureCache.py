@@ -0,0 +1,147 @@
+""" temperature data shared by all meters of a region.
+
+a regional temperature series is the same for thousands of meters, so what
+depends only on it is computed once per region and consumption grid and
+reused by every Extractor:
+
+- the temperature on the grid and the mask of known values ('aligned'),
+- the daily minima on the days of the grid (w_temp_cor_minima, w_temp_cor_maxmin),
+- the hourly, daily and weekly means of the resolution pyramid,
+- the temperature side of the line fits (k, w_temp_cor_*): the shift, the
+  shifted values and the per-group counts, sums and sums of squares, for
+  meters without missing readings where temperature is known.
+
+the region is data['region'], or the identity of the temperature Series when
+there is none (meters that share one Series object share its entry). an entry
+is reused only for a series equal to the one it was built from: the same object,
+or one that was compared equal before (Series.equals only runs the first time
+an entry sees an object). entries are kept for the `size` most recently used
+(region, dtype, grid) keys. astype converts the temperature of a region once,
+so that extractors with precision='float32' share the converted series.
+"""
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+
+class RegionTemperature:
+    """ cached data of one temperature series on one consumption grid. """
+
+    def __init__(self, temperature, index):
+        self.source = temperature
+        self.index = index
+        if temperature.index.equals(index):
+            t = temperature.values
+        else:
+            t = temperature.reindex(index).values
+        self.temperature = t
+        self.known = ~np.isnan(t)
+        self._daily = {}
+        self._levels = {}
+        self._sums = {}
+        # id -> objects that compared equal to source or index
+        self._verified = weakref.WeakValueDictionary()
+
+    def matches(self, temperature, index):
+        """ whether the entry is the one of temperature on index. """
+        return self._same(self.source, temperature) and self._same(self.index, index)
+
+    def _same(self, ours, other):
+        if ours is other or self._verified.get(id(other)) is other:
+            return True
+        if not ours.equals(other):
+            return False
+        self._verified[id(other)] = other
+        return True
+
+    def daily_minima(self, days):
+        """ daily temperature minima on the given days (labels of resample('D')). """
+        key = (days[0], len(days)) if len(days) else None
+        if key not in self._daily:
+            self._daily[key] = self.source.resample('D').min().reindex(days).values
+        return self._daily[key]
+
+    def levels(self, granularity):
+        """ {minutes: mean temperature} of the pyramid levels coarser than granularity,
+        each level aggregated from the previous one via its sums and counts. """
+        if granularity not in self._levels:
+            t_sum = self.source.fillna(0)
+            t_count = self.source.notna().astype(np.int32)
+            levels = {}
+            for minutes, rule in ((60, 'h'), (24*60, 'D'), (7*24*60, 'W')):
+                if minutes <= granularity:
+                    continue
+                t_sum = t_sum.resample(rule).sum()
+                t_count = t_count.resample(rule).sum()
+                levels[minutes] = t_sum/t_count.where(t_count > 0)
+            self._levels[granularity] = levels
+        return self._levels[granularity]
+
+    def sums(self, groups):
+        """ temperature side of line_fits for pairs where temperature is known, per
+        group of the (groups, samples) bool array. """
+        key = hashlib.sha1(np.ascontiguousarray(groups).view(np.uint8)).hexdigest()
+        if key not in self._sums:
+            # shaped like the single meter case of line_fits
+            self._sums[key] = x_sums(self.temperature.astype(np.float64).reshape(-1, 1),
+                                     self.known.reshape(-1, 1), groups)
+        return self._sums[key]
+
+
+def x_sums(x, valid, groups):
+    """ (x0, shifted x, n, sx, sxx): x shifted by its mean over valid and zeroed
+    elsewhere, the number of valid samples and the sums of shifted x and its
+    squares per group. """
+    x0 = np.nanmean(np.where(valid, x, np.nan), axis=0)
+    x = np.where(valid, x - x0, 0)
+    g = np.asarray(groups, dtype=np.float64)
+    return x0, x, g @ valid, g @ x, g @ (x*x)
+
+
+class TemperatureCache:
+    """ RegionTemperature entries keyed by (region, grid), least recently used
+    entries beyond size are dropped. """
+
+    def __init__(self, size=16):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, temperature, index, region):
+        key = (region, temperature.dtype.str, len(index), index[0], index[-1])
+        entry = self._lookup(key)
+        if entry is None or not entry.matches(temperature, index):
+            entry = self._store(key, RegionTemperature(temperature, index))
+        return entry
+
+    def astype(self, temperature, dtype, region):
+        """ temperature converted to dtype, the same object for every meter of the region. """
+        key = (region, 'astype', np.dtype(dtype).str)
+        entry = self._lookup(key)
+        if entry is None or not entry.matches(temperature, temperature.index):
+            entry = RegionTemperature(temperature, temperature.index)
+            entry.converted = temperature.astype(dtype)
+            self._store(key, entry)
+        return entry.converted
+
+    def _lookup(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()